@@ -1,5 +1,8 @@
 import serial
-from threading import Lock 
+from concurrent.futures import Future
+from threading import Lock, RLock, Timer
+from contextlib import contextmanager
+from typing import Final
 from .keyboard import KeyboardManager
 from .bar_graph import BarGraphManager
 from .screen import Screen
@@ -7,17 +10,60 @@ from .text import Text
 from .graphics import Graphics
 from .gpo import LedStatus, GPO
 from .filesystem import Filesystem
+from .font_manager import FontManager
+from .shadow_state import ShadowState
+from .serial_writer import SerialWriter, Lane
+from .receiver import ReceiveDemultiplexer, ResponseStream, fixedLengthParser
 from time import sleep
 
 class PyMOPanel:
-    def __init__(self, port = '/dev/ttyUSB0', baudrate = 19200, timeout = 1):
+    WRITE_BUFFER_SIZE: Final[int] = 4096
+    # code of each supported baud rate for the 0xfe 0x39 command
+    BAUD_RATE_CODES: Final[dict] = {9600:   0xCF,
+                                    14400:  0x8A,
+                                    19200:  0x67,
+                                    28800:  0x44,
+                                    38400:  0x33,
+                                    57600:  0x22,
+                                    76800:  0x19,
+                                    115200: 0x10}
+    HIGH_SPEED_BAUD_RATE: Final[int] = 115200
+    # with autoDetectBaudRate, the current baud rate of the panel is detected (see detectBaudRate) and then changed
+    # to baudrate, so the panel can be used at any rate regardless of the rate it was left at
+    def __init__(self, port = '/dev/ttyUSB0', baudrate = 19200, timeout = 1, autoDetectBaudRate = False):
         self._port = port
         self._baudrate = baudrate
         self._serialSendLock = Lock()
+        # high speed sessions, see highSpeed()
+        self._highSpeedLock = RLock()
+        self._highSpeedDepth = 0
+        self._baudRateBeforeHighSpeed = None
         self._serialReceiveLock = Lock()
+        # write coalescing: commands are appended to a preallocated buffer while in a batch() or in auto flush mode
+        self._writeBuffer = bytearray(PyMOPanel.WRITE_BUFFER_SIZE)
+        self._writeBufferLength = 0
+        self._batchDepth = 0
+        self._autoFlush = False
+        self._flushThreshold = PyMOPanel.WRITE_BUFFER_SIZE
+        self._flushDelay = None
+        self._flushTimer = None
+        self._writesCount = 0
+        self._bytesWritten = 0
+        # optional writer thread with priority lanes
+        self._serialWriter = SerialWriter(self._writeFromWriterThread)
         self._serialHandler = serial.Serial(port=port, baudrate=baudrate, timeout = timeout)
         if not self._serialHandler.is_open:
             raise Exception("MatrixOrbital device not found")
+        # optional single reader of the serial port
+        self._receiver = ReceiveDemultiplexer(self._serialHandler, timeout)
+        self.shadowState = ShadowState()
+        # before the subsystems send their initial settings, so they reach the panel at the right rate
+        if autoDetectBaudRate:
+            detectedBaudRate = self.detectBaudRate()
+            if detectedBaudRate is None:
+                print("Baud rate of the panel not detected, using {}".format(baudrate))
+            elif detectedBaudRate != baudrate:
+                self.setBaudRate(baudrate)
         self.screen = Screen(self)
         self.text   = Text(panel       = self,
                            fontRefId   = 0,
@@ -28,50 +74,284 @@ class PyMOPanel:
                            lineSpacing = 1,
                            lastYRow    = 64)
         self.fs = Filesystem(self)
+        self.fonts      = FontManager(self)
         self.graphics   = Graphics(self)
         self.gpo        = GPO(self)
         self.keyboard   = KeyboardManager(self, self._serialHandler)
         self.barGraphs  = BarGraphManager(self)
         
     # serial write and read functions
-    def writeBytes(self, buffer):
+    # lane is only used with the writer thread running. Then, interactive and bulk writes are not coalesced
+    def writeBytes(self, buffer, lane = Lane.NORMAL):
         with self._serialSendLock:
-            self._serialHandler.write(buffer)
+            if (self._batchDepth == 0 and not self._autoFlush) or (lane != Lane.NORMAL and self._serialWriter.isRunning()):
+                self._writeToSerial(buffer, lane)
+                return
+            self._appendToWriteBuffer(buffer)
 
+    # with the receiver running, only unsolicited input (i.e. keys) can be read
     def readBytes(self, requestedBytesCount):
+        # the pending commands may be the request for the data to read
+        self.flush()
+        if self._receiver.isRunning():
+            return self._receiver.readUnsolicited(requestedBytesCount, self._serialHandler.timeout)
         return self._serialHandler.read(requestedBytesCount)
 
     def resetInputState(self):
         self.keyboard.clearKeyBuffer()
-        self._serialHandler.reset_input_buffer()
+        self.flush()
+        if self._receiver.isRunning():
+            self._receiver.clearUnsolicited()
+        else:
+            self._serialHandler.reset_input_buffer()
+
+    # send a command whose response is parsed with parser (see receiver.py). Returns a Future with the result.
+    # With the receiver running, several queries can be pipelined: inside a batch() their commands are sent together
+    # when leaving it, so their results are only available after that
+    def query(self, command, parser):
+        if self._receiver.isRunning():
+            future = self._receiver.request(command, parser, self.writeBytes)
+            if self._batchDepth == 0:
+                self.flush()
+            return future
+        future = Future()
+        with self._serialReceiveLock:
+            self.writeBytes(command)
+            self.flush()
+            buffer = bytearray()
+            try:
+                parsed = parser(buffer)
+                while not isinstance(parsed, tuple):
+                    data = self._serialHandler.read(parsed - len(buffer))
+                    if not data:
+                        raise TimeoutError("no response from the panel ({} bytes received)".format(len(buffer)))
+                    buffer += data
+                    parsed = parser(buffer)
+                future.set_result(parsed[1])
+            except Exception as exception:
+                future.set_exception(exception)
+        return future
+
+    # send a command whose response is a little endian length of prefixLength bytes followed by the payload,
+    # and return a ResponseStream to read the payload in chunks of chunkSize bytes
+    def queryStream(self, command, prefixLength = 4, chunkSize = 256):
+        stream = ResponseStream(prefixLength, chunkSize, self._serialHandler.timeout)
+        if self._receiver.isRunning():
+            stream.setFuture(self.query(command, stream))
+        else:
+            self.writeBytes(command)
+            self.flush()
+            stream.setReadFunction(self._serialHandler.read)
+        return stream
+
+    # start the thread reading the serial port, which dispatches responses to the queries and keys
+    def startReceiver(self):
+        self.flush()
+        self._receiver.start()
+
+    def stopReceiver(self):
+        self._receiver.stop()
+
+    def isReceiverRunning(self):
+        return self._receiver.isRunning()
+
+    # callback receiving the unsolicited input (keys) while the receiver is running
+    def setUnsolicitedCallback(self, callback):
+        self._receiver.setUnsolicitedCallback(callback)
+
+    # coalesce all the writes in the context into a single one, sent when leaving it. Batches can be nested
+    @contextmanager
+    def batch(self):
+        with self._serialSendLock:
+            self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            with self._serialSendLock:
+                self._batchDepth -= 1
+                if self._batchDepth == 0:
+                    self._flushWriteBuffer()
+
+    # in auto flush mode every write is buffered, and sent when the buffer reaches flushThreshold bytes or after
+    # flushDelay seconds (if not None) since the first buffered write
+    def setAutoFlush(self, enabled, flushThreshold = WRITE_BUFFER_SIZE, flushDelay = 0.005):
+        with self._serialSendLock:
+            self._autoFlush = bool(enabled)
+            self._flushThreshold = min(flushThreshold, PyMOPanel.WRITE_BUFFER_SIZE) if self._autoFlush else PyMOPanel.WRITE_BUFFER_SIZE
+            self._flushDelay = flushDelay if self._autoFlush else None
+            if not self._autoFlush:
+                self._flushWriteBuffer()
+
+    # send the buffered writes, and wait for the writer thread to send its queued ones
+    def flush(self):
+        with self._serialSendLock:
+            self._flushWriteBuffer()
+        if self._serialWriter.isRunning():
+            self._serialWriter.waitUntilEmpty()
+
+    # with the writer thread running, writes are queued and sent from it: interactive lane first, bulk lane last
+    def startWriterThread(self):
+        self.flush()
+        self._serialWriter.start()
+
+    def stopWriterThread(self):
+        self.flush()
+        self._serialWriter.stop()
+
+    def isWriterThreadRunning(self):
+        return self._serialWriter.isRunning()
+
+    # returns the LaneStatistics (write latencies) of each Lane of the writer thread
+    def getLaneStatistics(self):
+        return self._serialWriter.getLaneStatistics()
+
+    # returns the number of serial writes done and the bytes sent with them
+    def getWriteStatistics(self):
+        return {'writes': self._writesCount, 'bytes': self._bytesWritten}
+
+    def _writeNow(self, buffer):
+        self._serialHandler.write(buffer)
+        self._writesCount += 1
+        self._bytesWritten += len(buffer)
+
+    def _writeFromWriterThread(self, buffer, lane):
+        self._writeNow(buffer)
+        if lane == Lane.BULK:
+            # wait until the chunk is sent, so a higher priority write doesn't wait behind several chunks
+            self._serialHandler.flush()
+
+    # the following methods require _serialSendLock to be held
+    def _writeToSerial(self, buffer, lane = Lane.NORMAL):
+        if self._serialWriter.isRunning():
+            self._serialWriter.put(buffer, lane)
+            return
+        self._writeNow(buffer)
+
+    def _appendToWriteBuffer(self, buffer):
+        length = len(buffer)
+        if self._writeBufferLength + length > PyMOPanel.WRITE_BUFFER_SIZE:
+            self._flushWriteBuffer()
+        if length > PyMOPanel.WRITE_BUFFER_SIZE:
+            self._writeToSerial(buffer)
+            return
+        self._writeBuffer[self._writeBufferLength:self._writeBufferLength+length] = buffer
+        self._writeBufferLength += length
+        if self._writeBufferLength >= self._flushThreshold:
+            self._flushWriteBuffer()
+        elif self._flushDelay is not None and self._flushTimer is None:
+            self._flushTimer = Timer(self._flushDelay, self.flush)
+            self._flushTimer.daemon = True
+            self._flushTimer.start()
+
+    def _flushWriteBuffer(self):
+        if self._flushTimer:
+            self._flushTimer.cancel()
+            self._flushTimer = None
+        if self._writeBufferLength == 0:
+            return
+        self._writeToSerial(bytes(self._writeBuffer[:self._writeBufferLength]))
+        self._writeBufferLength = 0
         
     # setup
     def setBaudRate(self, baudrate):
-        speed={9600:   0xCF,
-               14400:  0x8A,
-               19200:  0x67,
-               28800:  0x44,
-               38400:  0x33,
-               57600:  0x22,
-               76800:  0x19,
-               115200: 0x10}[baudrate]
+        speed = PyMOPanel.BAUD_RATE_CODES[baudrate]
         self.writeBytes([0xfe, 0x39, speed])
+        self.flush()
         sleep(0.1)
         self._serialHandler.baudrate = baudrate
 
     def getBaudRate(self):
         return self._serialHandler.baudrate
 
+    # use the high speed baud rate in the context, for a whole batch of operations. Sessions can be nested (also
+    # from several threads): the baud rate is only changed when the first one starts, and restored when the last
+    # one ends
+    @contextmanager
+    def highSpeed(self):
+        with self._highSpeedLock:
+            if self._highSpeedDepth == 0:
+                self._baudRateBeforeHighSpeed = self.getBaudRate()
+                if self._baudRateBeforeHighSpeed != PyMOPanel.HIGH_SPEED_BAUD_RATE:
+                    self.setBaudRate(PyMOPanel.HIGH_SPEED_BAUD_RATE)
+            self._highSpeedDepth += 1
+        try:
+            yield self
+        finally:
+            with self._highSpeedLock:
+                self._highSpeedDepth -= 1
+                if self._highSpeedDepth == 0 and self.getBaudRate() != self._baudRateBeforeHighSpeed:
+                    self.setBaudRate(self._baudRateBeforeHighSpeed)
+
+    def isHighSpeedSessionActive(self):
+        return self._highSpeedDepth > 0
+
+    # find the baud rate of the panel, sending the free space query (which changes nothing) at each candidate rate
+    # until two consecutive valid and equal responses are received: 4 bytes with a size up to the filesystem size (a
+    # third try is allowed, in case garbage sent at a wrong rate left a command unfinished). The host is left at the
+    # detected rate, which is returned, or at the previous rate if none is detected (then None is returned).
+    # Commands sent at a wrong rate may leave garbage on the screen and change settings, so the shadow state is
+    # invalidated. Settings sent before at a wrong rate are not sent again, so prefer autoDetectBaudRate, which
+    # detects the rate before the subsystems send their initial settings
+    def detectBaudRate(self, candidates = None, probeTimeout = 0.2):
+        previousBaudRate = self.getBaudRate()
+        if candidates is None:
+            candidates = [previousBaudRate, 19200, PyMOPanel.HIGH_SPEED_BAUD_RATE] + list(PyMOPanel.BAUD_RATE_CODES)
+        receiverWasRunning = self.isReceiverRunning()
+        self.stopReceiver()
+        previousTimeout = self._serialHandler.timeout
+        self._serialHandler.timeout = probeTimeout
+        detectedBaudRate = None
+        try:
+            self.flush()
+            for baudrate in dict.fromkeys(candidates):
+                self._serialHandler.baudrate = baudrate
+                sleep(0.1)
+                self._serialHandler.reset_input_buffer()
+                previousFreeBytes = None
+                for _ in range(3):
+                    freeBytes = self._probeFreeSpace()
+                    if freeBytes is not None and freeBytes == previousFreeBytes:
+                        detectedBaudRate = baudrate
+                        break
+                    previousFreeBytes = freeBytes
+                if detectedBaudRate:
+                    break
+        finally:
+            self._serialHandler.timeout = previousTimeout
+            if detectedBaudRate is None:
+                self._serialHandler.baudrate = previousBaudRate
+            self.shadowState.invalidate()
+            if receiverWasRunning:
+                self.startReceiver()
+        return detectedBaudRate
+
+    # free space in the filesystem, or None if there is no valid response
+    def _probeFreeSpace(self):
+        try:
+            freeBytes = self.query([0xfe, 0xaf], fixedLengthParser(4, lambda response: int.from_bytes(response, byteorder='little', signed=False))).result()
+        except TimeoutError:
+            return None
+        return freeBytes if freeBytes <= Filesystem.FILESYSTEM_SIZE else None
+
+    def getVersionNumberAsync(self):
+        return self.query([0xfe, 0x36], fixedLengthParser(1, lambda version: "{}.{}".format(version[0]&0xf, (version[0]>>4)&0xf)))
+
     def getVersionNumber(self):
-        self.writeBytes([0xfe, 0x36])
-        version = self.readBytes(1)
-        return "{}.{}".format(version[0]&0xf, (version[0]>>4)&0xf) if version else ""
+        try:
+            return self.getVersionNumberAsync().result()
+        except TimeoutError:
+            return ""
+
+    def getModuleTypeAsync(self):
+        return self.query([0xfe, 0x37], fixedLengthParser(1, lambda module: PyMOPanel._getModuleName(module[0])))
 
     def getModuleType(self):
-        self.writeBytes([0xfe, 0x37])
-        module = self.readBytes(1)
-        if not module or len(module)==0:
+        try:
+            return self.getModuleTypeAsync().result()
+        except TimeoutError:
             return ""
+
+    def _getModuleName(moduleId):
         return  {0x01: "LCD0821",            0x02: "LCD2021",
                  0x05: "LCD2041",            0x06: "LCD4021",
                  0x07: "LCD4041",            0x08: "LK202-25",
@@ -107,4 +387,4 @@ class PyMOPanel:
                  0x58: "VK204-25-USB",       0x5B: "LK162-12-TC",
                  0x72: "GLK240128-25",       0x73: "LK404-25",
                  0x74: "VK404-25",           0x78: "GLT320240",
-                 0x79: "GLT480282",          0x7A: "GLT240128"}[module[0]]
+                 0x79: "GLT480282",          0x7A: "GLT240128"}[moduleId]
@@ -1,4 +1,5 @@
 from enum import Enum
+from threading import Thread, Lock, Event
 from typing import Final
 
 class Direction(Enum):
@@ -26,6 +27,13 @@ class BarGraphManager:
     def __init__(self, panel):
         self._barGraphs = []
         self._panel = panel
+        # rate limited mode: values set since the last flush (latest value wins), sent by the flusher thread
+        self._pendingValues = {}
+        self._pendingLock = Lock()
+        self._updatePeriod = None
+        self._flusherThread = None
+        self._stopFlusher = Event()
+        self._bytesSent = 0
     # add bar graph. Returns index, or raise exception if full
     def addBarGraph(self, x0, y0, width, height, direction):
         if len(self._barGraphs) == BarGraphManager.MAX_NUMBER_OF_BARS:
@@ -44,12 +52,65 @@ class BarGraphManager:
                          self._barGraphs[-1]._y0,
                          self._barGraphs[-1]._x1,
                          self._barGraphs[-1]._y1])
+        # the first value is always sent
+        self._panel.shadowState.invalidate(('barGraph', index))
         return index
     
     def setBarGraphValue(self, index, value):
-        self._barGraphs[index].setValue(value)
-        self._panel.writeBytes([0xfe, 0x69,
-                               index,
-                               self._barGraphs[index].getValueInPixels()])
+        self.setBarGraphValues({index: value})
+
+    # set the value of several bars ({index: value}). Only the bars whose value in pixels changed are sent, in a
+    # single write, or on the next flush in rate limited mode
+    def setBarGraphValues(self, values):
+        if self._updatePeriod:
+            with self._pendingLock:
+                self._pendingValues.update(values)
+            return
+        self._sendValues(values)
+
+    # limit the updates sent to the panel to updatesPerSecond, for producers faster than the serial link.
+    # None disables the limit and sends the pending values
+    def setUpdateRate(self, updatesPerSecond):
+        if self._flusherThread:
+            self._stopFlusher.set()
+            self._flusherThread.join()
+            self._flusherThread = None
+        self._updatePeriod = 1. / updatesPerSecond if updatesPerSecond else None
+        if self._updatePeriod:
+            self._stopFlusher.clear()
+            self._flusherThread = Thread(target=self._runFlusher, daemon=True)
+            self._flusherThread.start()
+        else:
+            self.flush()
+
+    # bytes sent to update the values (to compare with HostBarGraphManager)
+    def getBytesSent(self):
+        return self._bytesSent
+
+    # send the pending values of the rate limited mode
+    def flush(self):
+        with self._pendingLock:
+            values = self._pendingValues
+            self._pendingValues = {}
+        if values:
+            self._sendValues(values)
+
+    def _runFlusher(self):
+        while not self._stopFlusher.wait(self._updatePeriod):
+            self.flush()
+
+    # the values are marked as sent and written while holding the write lock of the shadow state, so a clear of the
+    # screen from another thread is written either before them or after they are invalidated
+    def _sendValues(self, values):
+        buffer = bytearray()
+        with self._panel.shadowState.getWriteLock():
+            for index, value in values.items():
+                self._barGraphs[index].setValue(value)
+                valueInPixels = self._barGraphs[index].getValueInPixels()
+                if self._panel.shadowState.update(('barGraph', index), valueInPixels):
+                    buffer += bytes([0xfe, 0x69, index, valueInPixels])
+            if buffer:
+                self._panel.writeBytes(buffer)
+        self._bytesSent += len(buffer)
 
 
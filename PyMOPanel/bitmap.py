@@ -0,0 +1,78 @@
+from PIL import Image
+from typing import Final
+from math import ceil
+import numpy as np
+
+# bits per pixel for the supported PIL image modes
+BIT_DEPTH_PER_MODE: Final[dict] = {'1':1, 'L':8, 'P':8, 'RGB':24, 'RGBA':32, 'CMYK':32, 'YCbCr':24, 'I':32, 'F':32}
+
+# size of the panel screen (as Graphics.PANEL_WIDTH and Graphics.PANEL_HEIGHT)
+SCREEN_WIDTH:  Final[int] = 192
+SCREEN_HEIGHT: Final[int] = 64
+
+# convert a PIL image into a (height, width) array of 1 bit pixels. The raw bytes of each pixel are averaged
+# and compared against the threshold, so a pixel below it is set (1) unless inverted
+def imageToBitArray(img, thresholdForBW=50, inverted=False):
+    if img.mode == '1':
+        img = img.convert('L')
+    bytesPerPixel = BIT_DEPTH_PER_MODE[img.mode] // 8
+    pixelsCount = img.width * img.height
+    channels = np.frombuffer(img.tobytes(), dtype=np.uint8)[:pixelsCount*bytesPerPixel].reshape(pixelsCount, bytesPerPixel)
+    average = channels.sum(axis=1, dtype=np.uint32) / bytesPerPixel
+    bits = (average < thresholdForBW) != bool(inverted)
+    return bits.astype(np.uint8).reshape(img.height, img.width)
+
+# build the 0xfe 0x64 command to show a bit array at x0,y0. Pixels are packed as a continuous stream
+# (rows are not padded), only the last byte is zero padded
+def bitArrayToBitmapCommand(bits, x0=0, y0=0):
+    height, width = bits.shape
+    packed = np.packbits(bits, axis=None)
+    outputArray = bytearray(6 + packed.size)
+    outputArray[0:6] = bytes([0xfe, 0x64, x0, y0, width, height])
+    outputArray[6:] = packed.data
+    return bytes(outputArray)
+
+# cost in bytes of sending a width x height region as a 0xfe 0x64 bitmap command
+def bitmapCommandSize(width, height):
+    return 6 + ceil(width * height / 8)
+
+# inverse of bitArrayToBitmapCommand. Returns (bits, x0, y0)
+def bitmapCommandToBitArray(command):
+    x0, y0, width, height = command[2], command[3], command[4], command[5]
+    packed = np.frombuffer(command, dtype=np.uint8, offset=6)
+    return np.unpackbits(packed, count=width*height).reshape(height, width), x0, y0
+
+# split a 0xfe 0x64 command into commands of horizontal bands of up to maxCommandSize bytes (at least one row)
+def splitBitmapCommand(command, maxCommandSize):
+    bits, x0, y0 = bitmapCommandToBitArray(command)
+    height, width = bits.shape
+    rowsPerChunk = max(1, (maxCommandSize - 6) * 8 // width)
+    if rowsPerChunk >= height:
+        return [command]
+    return [bitArrayToBitmapCommand(bits[row:row+rowsPerChunk], x0, y0 + row) for row in range(0, height, rowsPerChunk)]
+
+# resize an image to fit in maxWidth x maxHeight keeping its aspect ratio, as ImageMagick -resize. Images that
+# already fit are returned as they are, unless enlarge is set
+def fitImage(img, maxWidth=SCREEN_WIDTH, maxHeight=SCREEN_HEIGHT, enlarge=False):
+    scale = min(maxWidth / img.width, maxHeight / img.height)
+    if scale == 1 or (scale > 1 and not enlarge):
+        return img
+    return img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+
+# indexes of the frames shown of an image. The first frame of an animation is skipped
+def getFrameIndexes(img):
+    framesCount = getattr(img, 'n_frames', 1)
+    return range(1, framesCount) if framesCount > 1 else range(1)
+
+# area of the screen from x0,y0, where frames are fitted
+def getFitSize(x0, y0):
+    return max(1, SCREEN_WIDTH - x0), max(1, SCREEN_HEIGHT - y0)
+
+# generator of the 0xfe 0x64 commands for each frame of a bitmap. It could be an animated gif. With fit, frames
+# bigger than the screen area from x0,y0 are reduced to fit in it
+def encodeBitmapFile(inputFilename, x0=0, y0=0, thresholdForBW=50, inverted=False, fit=True):
+    img = Image.open(inputFilename)
+    for frame in getFrameIndexes(img):
+        img.seek(frame)
+        frameImage = fitImage(img, *getFitSize(x0, y0)) if fit else img
+        yield bitArrayToBitmapCommand(imageToBitArray(frameImage, thresholdForBW, inverted), x0, y0)
@@ -0,0 +1,148 @@
+import time
+import numpy as np
+from .delta_encoder import DeltaEncoder
+from .graphics import Graphics, PlaybackStatistics
+from .text_layout import TextLayout
+
+# 1 bit copy of the screen to draw on the host. Drawing only changes the canvas, and flush() sends the areas that
+# changed since the last flush as 0xfe 0x64 bitmap patches, in a single write, or with the cheapest commands if a
+# CommandEncoder is set. Coordinates out of the canvas are clipped, and value is 1 (on) or 0 (off)
+class Canvas:
+    def __init__(self, panel, width = Graphics.PANEL_WIDTH, height = Graphics.PANEL_HEIGHT, commandEncoder = None):
+        self._panel = panel
+        self._bits = np.zeros((height, width), dtype=np.uint8)
+        # content of the panel after the last flush, None if unknown
+        self._flushedBits = None
+        self._deltaEncoder = DeltaEncoder()
+        self._commandEncoder = commandEncoder
+        self._statistics = PlaybackStatistics()
+        self._lastFlushBytes = 0
+        self._lastFlushDuration = 0.
+
+    def setCommandEncoder(self, commandEncoder):
+        self._commandEncoder = commandEncoder
+
+    def getCommandEncoder(self):
+        return self._commandEncoder
+
+    def getWidth(self):
+        return self._bits.shape[1]
+
+    def getHeight(self):
+        return self._bits.shape[0]
+
+    # the (height, width) array of bits. It can be modified directly
+    def getBits(self):
+        return self._bits
+
+    # PlaybackStatistics with one frame per flush that sent something
+    def getStatistics(self):
+        return self._statistics
+
+    def getLastFlushBytes(self):
+        return self._lastFlushBytes
+
+    # seconds taken by the last flush to encode and write the changes
+    def getLastFlushDuration(self):
+        return self._lastFlushDuration
+
+    # forget what the panel shows, so the next flush sends the whole canvas
+    def invalidate(self):
+        self._flushedBits = None
+
+    # the screen was cleared, so the next flush only sends what is drawn
+    def markCleared(self):
+        self._flushedBits = np.zeros_like(self._bits)
+
+    def clear(self, value = 0):
+        self._bits[:] = value
+
+    def drawPixel(self, x, y, value = 1):
+        self._plot(np.array([x]), np.array([y]), value)
+
+    # plot the points (xs, ys), dropping the ones out of the canvas
+    def drawPixels(self, xs, ys, value = 1):
+        self._plot(np.asarray(xs, dtype=np.int64).ravel(), np.asarray(ys, dtype=np.int64).ravel(), value)
+
+    def drawLine(self, x0, y0, x1, y1, value = 1):
+        stepsCount = max(abs(x1 - x0), abs(y1 - y0)) + 1
+        xs = np.rint(np.linspace(x0, x1, stepsCount)).astype(np.int64)
+        ys = np.rint(np.linspace(y0, y1, stepsCount)).astype(np.int64)
+        self._plot(xs, ys, value)
+
+    # rectangle with the corners x0,y0 and x1,y1 (both included), as in Graphics.drawRectangle
+    def drawRectangle(self, x0, y0, x1, y1, value = 1, solid = False):
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        if solid:
+            self._fill(x0, y0, x1 + 1, y1 + 1, value)
+            return
+        self._fill(x0, y0, x1 + 1, y0 + 1, value)
+        self._fill(x0, y1, x1 + 1, y1 + 1, value)
+        self._fill(x0, y0, x0 + 1, y1 + 1, value)
+        self._fill(x1, y0, x1 + 1, y1 + 1, value)
+
+    def drawCircle(self, centerX, centerY, radius, value = 1, solid = False):
+        ys, xs = np.mgrid[centerY - radius - 1:centerY + radius + 2, centerX - radius - 1:centerX + radius + 2]
+        distances = np.hypot(xs - centerX, ys - centerY)
+        mask = distances < radius + 0.5
+        if not solid:
+            mask &= distances >= radius - 0.5
+        self._plot(xs[mask], ys[mask], value)
+
+    # copy a (height, width) array of bits at x0,y0. If transparent, only its 1 bits are drawn
+    def blit(self, bits, x0, y0, transparent = False):
+        height, width = bits.shape
+        canvasHeight, canvasWidth = self._bits.shape
+        left, top = max(0, -x0), max(0, -y0)
+        right, bottom = min(width, canvasWidth - x0), min(height, canvasHeight - y0)
+        if left >= right or top >= bottom:
+            return
+        source = bits[top:bottom, left:right] != 0
+        target = self._bits[y0 + top:y0 + bottom, x0 + left:x0 + right]
+        if transparent:
+            target[source] = 1
+        else:
+            target[:] = source
+
+    # draw text with the glyphs of a Font from the pixel x,y, in a single line. Chars out of the font are skipped
+    def drawText(self, text, x, y, font, charSpacing = 1, transparent = False):
+        asciiStart, asciiEnd = font.getAsciiRange()
+        codes = np.frombuffer(bytes(text, 'latin-1', 'replace') if type(text) == str else bytes(text), dtype=np.uint8)
+        positions = TextLayout(font, charSpacing=charSpacing).getCharPositions(codes.tobytes(), x)
+        for code, charX in zip(codes.tolist(), positions.tolist()):
+            if asciiStart <= code <= asciiEnd:
+                self.blit(font.getGlyphBits(code - asciiStart), charX, y, transparent)
+
+    # send the changes since the last flush. Returns the number of bytes sent
+    def flush(self):
+        startTime = time.perf_counter()
+        if self._commandEncoder:
+            plan = self._commandEncoder.encodeFrame(self._bits, self._flushedBits, drawingColor=self._panel.shadowState.get('drawingColor'))
+            self._lastFlushBytes = plan.send(self._panel)
+        else:
+            if self._flushedBits is None:
+                self._deltaEncoder.reset()
+            else:
+                self._deltaEncoder.setPreviousFrame(self._flushedBits)
+            commands = self._deltaEncoder.encode(self._bits)
+            if commands:
+                with self._panel.batch():
+                    for command in commands:
+                        self._panel.graphics.writeBitmapCommand(command)
+            self._lastFlushBytes = sum(len(command) for command in commands)
+        self._flushedBits = self._bits.copy()
+        self._lastFlushDuration = time.perf_counter() - startTime
+        if self._lastFlushBytes:
+            self._statistics.addFrame(self._lastFlushBytes)
+        return self._lastFlushBytes
+
+    def _plot(self, xs, ys, value):
+        height, width = self._bits.shape
+        inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        self._bits[ys[inside], xs[inside]] = value
+
+    # fill the x0..x1, y0..y1 area, with x1 and y1 exclusive
+    def _fill(self, x0, y0, x1, y1, value):
+        height, width = self._bits.shape
+        self._bits[max(y0, 0):max(min(y1, height), 0), max(x0, 0):max(min(x1, width), 0)] = value
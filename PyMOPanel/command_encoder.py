@@ -0,0 +1,204 @@
+import numpy as np
+from .bitmap import bitArrayToBitmapCommand, bitmapCommandSize
+from .delta_encoder import findDirtyBoxes
+
+# bytes of each command
+_COLOR_SIZE     = 3     # 0xfe 0x63 color
+_PIXEL_SIZE     = 4     # 0xfe 0x70 x y
+_LINE_SIZE      = 6     # 0xfe 0x6c x0 y0 x1 y1
+_RECTANGLE_SIZE = 7     # 0xfe 0x78 color x0 y0 x1 y1
+
+# operations of a plan and how they are sent, as Graphics method calls
+class EncodingPlan:
+    def __init__(self):
+        self._operations = []   # (method name, arguments)
+        self._parts = []        # (strategy, x0, y0, width, height, size)
+        self._size = 0
+
+    def getSize(self):
+        return self._size
+
+    # (strategy, x0, y0, width, height, size) of each encoded region
+    def getParts(self):
+        return list(self._parts)
+
+    def getOperations(self):
+        return list(self._operations)
+
+    def addPart(self, strategy, x0, y0, width, height, operations, size):
+        self._operations += operations
+        self._parts.append((strategy, x0, y0, width, height, size))
+        self._size += size
+
+    # send the operations in a single write
+    def send(self, panel):
+        graphics = panel.graphics
+        with panel.batch():
+            for methodName, arguments in self._operations:
+                getattr(graphics, methodName)(*arguments)
+        return self._size
+
+    def __repr__(self):
+        strategies = {}
+        for strategy, _, _, _, _, size in self._parts:
+            count, totalSize = strategies.get(strategy, (0, 0))
+            strategies[strategy] = (count + 1, totalSize + size)
+        return "{} bytes ({})".format(self._size, ", ".join("{}: {} regions, {} bytes".format(strategy, count, size) for strategy, (count, size) in strategies.items()))
+
+# encodes the update of a 1 bit region of the screen, from its known content, with the cheapest of:
+# - 'bitmap': a 0xfe 0x64 bitmap of the region
+# - 'rectangles': solid rectangles covering the pixels to turn on and the ones to turn off
+# - 'lines': horizontal or vertical lines (or pixels, if 1 pixel long) in the drawing color
+# - 'pixels': one pixel per changed pixel, in the drawing color
+# The drawing color is the one of the panel shadow state, and lines and pixels change it when needed
+class CommandEncoder:
+    STRATEGIES = ('bitmap', 'rectangles', 'lines', 'pixels')
+
+    # plan updating the (height, width) region at x0,y0 from currentBits (None if unknown) to targetBits
+    def encode(self, targetBits, currentBits = None, x0 = 0, y0 = 0, drawingColor = None):
+        plan = EncodingPlan()
+        self._encodeRegion(plan, targetBits != 0, None if currentBits is None else currentBits != 0, x0, y0, drawingColor)
+        return plan
+
+    # plan updating a frame, encoding each dirty box of the frame with its cheapest strategy. The whole frame is
+    # sent as a bitmap if that is cheaper
+    def encodeFrame(self, targetBits, currentBits = None, x0 = 0, y0 = 0, drawingColor = None):
+        height, width = targetBits.shape
+        target = targetBits != 0
+        if currentBits is None:
+            return self.encode(targetBits, None, x0, y0, drawingColor)
+        current = currentBits != 0
+        plan = EncodingPlan()
+        for rowStart, rowEnd, colStart, colEnd in findDirtyBoxes(target != current):
+            drawingColor = self._encodeRegion(plan,
+                                              target[rowStart:rowEnd, colStart:colEnd],
+                                              current[rowStart:rowEnd, colStart:colEnd],
+                                              x0 + colStart, y0 + rowStart, drawingColor)
+        if plan.getSize() >= bitmapCommandSize(width, height):
+            plan = EncodingPlan()
+            self._addBitmap(plan, target, x0, y0)
+        return plan
+
+    # byte cost of each strategy for a region (None if it exceeds the raw bitmap)
+    def estimateCosts(self, targetBits, currentBits = None, drawingColor = None):
+        target = targetBits != 0
+        current = None if currentBits is None else currentBits != 0
+        costs = {'bitmap': bitmapCommandSize(target.shape[1], target.shape[0])}
+        for strategy in CommandEncoder.STRATEGIES[1:]:
+            result = self._planStrategy(strategy, target, current, 0, 0, drawingColor, costs['bitmap'])
+            costs[strategy] = result[1] if result else None
+        return costs
+
+    # returns the drawing color after the region
+    def _encodeRegion(self, plan, target, current, x0, y0, drawingColor):
+        height, width = target.shape
+        bestSize = bitmapCommandSize(width, height)
+        best = None
+        for strategy in CommandEncoder.STRATEGIES[1:]:
+            result = self._planStrategy(strategy, target, current, x0, y0, drawingColor, bestSize)
+            if result and result[1] < bestSize:
+                best = (strategy,) + result
+                bestSize = result[1]
+        if best is None:
+            self._addBitmap(plan, target, x0, y0)
+            return drawingColor
+        strategy, operations, size, drawingColor = best
+        plan.addPart(strategy, x0, y0, width, height, operations, size)
+        return drawingColor
+
+    def _addBitmap(self, plan, target, x0, y0):
+        height, width = target.shape
+        command = bitArrayToBitmapCommand(target.astype(np.uint8), x0, y0)
+        plan.addPart('bitmap', x0, y0, width, height, [('writeBitmapCommand', (command,))], len(command))
+
+    # returns (operations, size, drawing color after them), or None if the size reaches maxSize
+    def _planStrategy(self, strategy, target, current, x0, y0, drawingColor, maxSize):
+        if current is None:
+            needOn, needOff = target, ~target
+        else:
+            needOn, needOff = target & ~current, ~target & current
+        if strategy == 'rectangles':
+            operations = []
+            for color, need, allowed in ((255, needOn, target), (0, needOff, ~target)):
+                rectangles = CommandEncoder._coverWithRectangles(need, allowed, (maxSize - 1) // _RECTANGLE_SIZE - len(operations))
+                if rectangles is None:
+                    return None
+                operations += [('drawRectangle', (color, x0 + left, y0 + top, x0 + right - 1, y0 + bottom - 1, True)) for left, top, right, bottom in rectangles]
+            return operations, len(operations) * _RECTANGLE_SIZE, drawingColor
+
+        # lines and pixels use the drawing color, so the group of the current color goes first
+        groups = [(255, needOn, target), (0, needOff, ~target)]
+        if drawingColor == 0:
+            groups.reverse()
+        operations = []
+        size = 0
+        for color, need, allowed in groups:
+            if not need.any():
+                continue
+            if drawingColor is None or (drawingColor != 0) != (color != 0):
+                operations.append(('setDrawingColor', (color,)))
+                size += _COLOR_SIZE
+                drawingColor = color
+            if strategy == 'pixels':
+                ys, xs = np.nonzero(need)
+                operations += [('drawPixel', (x0 + x, y0 + y)) for x, y in zip(xs.tolist(), ys.tolist())]
+                size += len(xs) * _PIXEL_SIZE
+            else:
+                segments, segmentsSize = CommandEncoder._findLines(need, allowed)
+                operations += [('drawPixel', (x0 + xStart, y0 + yStart)) if (xStart, yStart) == (xEnd, yEnd)
+                               else ('drawLine', (x0 + xStart, y0 + yStart, x0 + xEnd, y0 + yEnd)) for xStart, yStart, xEnd, yEnd in segments]
+                size += segmentsSize
+            if size >= maxSize:
+                return None
+        return operations, size, drawingColor
+
+    # cheapest of horizontal and vertical segments covering need, extended only through allowed pixels.
+    # Returns ([(xStart, yStart, xEnd, yEnd)], size) with the ends included
+    def _findLines(need, allowed):
+        horizontal = CommandEncoder._findRows(need, allowed)
+        vertical = [(x0, y0, x1, y1) for y0, x0, y1, x1 in CommandEncoder._findRows(need.T, allowed.T)]
+        segments = min(horizontal, vertical, key=CommandEncoder._linesSize)
+        return segments, CommandEncoder._linesSize(segments)
+
+    def _linesSize(segments):
+        return sum(_PIXEL_SIZE if (xStart, yStart) == (xEnd, yEnd) else _LINE_SIZE for xStart, yStart, xEnd, yEnd in segments)
+
+    # row segments from the first to the last needed pixel of each run of allowed pixels
+    def _findRows(need, allowed):
+        height, width = need.shape
+        allowedFlat = allowed.ravel()
+        # a run starts at allowed pixels after a not allowed one or at the start of a row
+        runStarts = allowedFlat.copy()
+        runStarts[1:] &= ~allowedFlat[:-1] | (np.arange(1, allowedFlat.size) % width == 0)
+        runIds = np.cumsum(runStarts)
+        needIndexes = np.flatnonzero(need.ravel())
+        if needIndexes.size == 0:
+            return []
+        needRunIds = runIds[needIndexes]
+        isFirst = np.concatenate(([True], needRunIds[1:] != needRunIds[:-1]))
+        isLast = np.concatenate((needRunIds[1:] != needRunIds[:-1], [True]))
+        starts, ends = needIndexes[isFirst], needIndexes[isLast]
+        return [(start % width, start // width, end % width, end // width) for start, end in zip(starts.tolist(), ends.tolist())]
+
+    # greedy cover of the need pixels with rectangles of allowed pixels, as (left, top, right, bottom) with right
+    # and bottom exclusive. Returns None if more than maxCount rectangles are needed
+    def _coverWithRectangles(need, allowed, maxCount):
+        need = need.copy()
+        height, width = need.shape
+        rectangles = []
+        while True:
+            pending = np.flatnonzero(need)
+            if pending.size == 0:
+                return rectangles
+            if len(rectangles) >= maxCount:
+                return None
+            top, left = divmod(int(pending[0]), width)
+            # widest run of allowed pixels from left, trimmed to the last needed pixel in it
+            row = allowed[top, left:]
+            runLength = int(np.argmin(row)) if not row.all() else len(row)
+            right = left + int(np.flatnonzero(need[top, left:left + runLength])[-1]) + 1
+            # extend down while the whole span is allowed
+            rows = allowed[top:, left:right].all(axis=1)
+            bottom = top + (int(np.argmin(rows)) if not rows.all() else len(rows))
+            need[top:bottom, left:right] = False
+            rectangles.append((left, top, right, bottom))
@@ -0,0 +1,151 @@
+import itertools
+import time
+from threading import Thread, Event, Lock
+from .bitmap import bitmapCommandToBitArray
+from .canvas import Canvas
+from .frame_scheduler import FrameScheduler
+from .graphics import PlaybackStatistics
+from .helpers import useHighSpeedDecorator
+
+# frames and timing of an animation of the compositor
+class Animation:
+    def __init__(self, frames, x0, y0, framesPerSecond, loop):
+        self._frames = frames
+        self._x0 = x0
+        self._y0 = y0
+        self._framePeriod = 1 / framesPerSecond
+        self._loop = loop
+        self._startTimestamp = None
+        # number of the frame shown (counting the loops), -1 before the first one
+        self._shownFrame = -1
+
+    def isFinished(self):
+        return not self._loop and self._shownFrame >= len(self._frames) - 1
+
+    # number of the frame due at timestamp, counting the loops
+    def getDueFrame(self, timestamp):
+        if self._startTimestamp is None:
+            self._startTimestamp = timestamp
+        dueFrame = int((timestamp - self._startTimestamp) / self._framePeriod)
+        return dueFrame if self._loop else min(dueFrame, len(self._frames) - 1)
+
+    def getNextFrameTimestamp(self):
+        return self._startTimestamp + (self._shownFrame + 1) * self._framePeriod
+
+# plays several animations on different screen positions, each one at its own frame rate, from a single timing loop.
+# The frames due at each tick are drawn in a Canvas and sent in a single batched update with only what changed, so
+# frames of different animations are never interleaved and no thread is blocked per animation. Ticks wait for the
+# link to be free (predicted as in FrameScheduler), and the frames that became due meanwhile are merged: only the
+# latest one of each animation is drawn.
+# The compositor owns the screen while playing: it is cleared on the first tick, and overlapping animations are
+# drawn in the order they were added
+class AnimationCompositor:
+    def __init__(self, panel, commandEncoder = None):
+        self._panel = panel
+        self._canvas = Canvas(panel, commandEncoder=commandEncoder)
+        self._animations = {}
+        self._nextIndex = itertools.count()
+        self._lock = Lock()
+        self._stopEvent = Event()
+        self._thread = None
+        self._statistics = PlaybackStatistics()
+        self._screenCleared = False
+        self._linkFreeTimestamp = 0.
+        self._wireTime = 0.
+        self._lateFramesCount = 0
+        self._mergedFramesCount = 0
+
+    # add the frames of a bitmap (it could be an animated gif), converted as in Graphics.uploadAndShowBitmap.
+    # Returns its index
+    def addAnimation(self, inputFilename, x0 = 0, y0 = 0, framesPerSecond = 5, thresholdForBW = 50, inverted = False, loop = False):
+        frames = [bitmapCommandToBitArray(frame)[0] for frame in self._panel.graphics.getBitmapFrames(inputFilename, x0, y0, thresholdForBW, inverted)]
+        with self._lock:
+            index = next(self._nextIndex)
+            self._animations[index] = Animation(frames, x0, y0, framesPerSecond, loop)
+        return index
+
+    # remove an animation, clearing its area on the next tick
+    def removeAnimation(self, index):
+        with self._lock:
+            animation = self._animations.pop(index)
+            height, width = animation._frames[0].shape
+            self._canvas.drawRectangle(animation._x0, animation._y0, animation._x0 + width - 1, animation._y0 + height - 1, 0, solid=True)
+
+    def getAnimationsCount(self):
+        return len(self._animations)
+
+    def getCanvas(self):
+        return self._canvas
+
+    # PlaybackStatistics with one frame per tick that sent something
+    def getStatistics(self):
+        return self._statistics
+
+    # play until all the animations (not looping) are finished, stop() is called or duration seconds elapsed
+    @useHighSpeedDecorator
+    def play(self, duration = None):
+        self._statistics = PlaybackStatistics()
+        self._wireTime = 0.
+        self._lateFramesCount = 0
+        self._mergedFramesCount = 0
+        endTimestamp = time.time() + duration if duration is not None else None
+        while not self._stopEvent.is_set():
+            nextTickTimestamp = self.tick()
+            if nextTickTimestamp is None or (endTimestamp is not None and nextTickTimestamp >= endTimestamp):
+                break
+            self._stopEvent.wait(max(0., nextTickTimestamp - time.time()))
+        return self._statistics
+
+    # play in a thread
+    def start(self, duration = None):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = Thread(target=self.play, args=(duration,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopEvent.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._stopEvent.clear()
+
+    def isPlaying(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # draw the frames due now and send them. Returns when the next tick is due, or None if nothing is left to play
+    def tick(self):
+        now = time.time()
+        with self._lock:
+            if not self._screenCleared:
+                self._panel.screen.clear()
+                self._canvas.markCleared()
+                self._screenCleared = True
+            updatedAnimations = []
+            for animation in self._animations.values():
+                if animation.isFinished():
+                    continue
+                dueFrame = animation.getDueFrame(now)
+                if dueFrame == animation._shownFrame:
+                    continue
+                self._mergedFramesCount += max(0, dueFrame - animation._shownFrame - 1)
+                self._canvas.blit(animation._frames[dueFrame % len(animation._frames)], animation._x0, animation._y0)
+                animation._shownFrame = dueFrame
+                updatedAnimations.append(animation)
+            bytesSent = self._canvas.flush()
+            activeAnimations = [animation for animation in self._animations.values() if not animation.isFinished()]
+        if bytesSent:
+            wireTime = bytesSent * FrameScheduler.BITS_PER_BYTE / self._panel.getBaudRate()
+            self._linkFreeTimestamp = max(now, self._linkFreeTimestamp) + wireTime
+            self._wireTime += wireTime
+            self._statistics.addFrame(bytesSent)
+        # frames predicted to reach the panel after the next one was due
+        self._lateFramesCount += sum(1 for animation in updatedAnimations if self._linkFreeTimestamp > animation.getNextFrameTimestamp())
+        self._statistics.setSchedulingCounts(self._lateFramesCount, 0, self._mergedFramesCount, self._getLinkUtilization())
+        if not activeAnimations:
+            return None
+        return max(min(animation.getNextFrameTimestamp() for animation in activeAnimations), self._linkFreeTimestamp)
+
+    def _getLinkUtilization(self):
+        elapsedTime = self._statistics.getElapsedTime()
+        return min(1., self._wireTime / elapsedTime) if elapsedTime > 0 else 0.
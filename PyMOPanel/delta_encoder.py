@@ -0,0 +1,58 @@
+import numpy as np
+from .bitmap import bitArrayToBitmapCommand, bitmapCommandSize
+
+# returns (start, end) pairs of the True runs in a 1D mask, merging runs separated by up to maxGap False values
+def findRuns(mask, maxGap = 0):
+    indexes = np.flatnonzero(mask)
+    if indexes.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indexes) > maxGap + 1)
+    starts = np.concatenate(([indexes[0]], indexes[breaks + 1]))
+    ends   = np.concatenate((indexes[breaks], [indexes[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+# header bytes of a bitmap command, used to decide if two dirty boxes are worth merging
+_HEADER_SIZE = 6
+
+# returns (rowStart, rowEnd, colStart, colEnd) boxes covering the True values of a 2D mask: bands of rows, split in
+# columns. Merging two boxes costs the pixels in between, splitting them costs one more bitmap header
+def findDirtyBoxes(mask):
+    boxes = []
+    for rowStart, rowEnd in findRuns(mask.any(axis=1), _HEADER_SIZE * 8 // mask.shape[1]):
+        band = mask[rowStart:rowEnd]
+        for colStart, colEnd in findRuns(band.any(axis=0), _HEADER_SIZE * 8 // (rowEnd - rowStart)):
+            boxes.append((rowStart, rowEnd, colStart, colEnd))
+    return boxes
+
+# keeps the last sent 1 bit frame and encodes the next ones as bitmap patches of their dirty bounding boxes.
+# A full frame is sent when there is no previous frame at the same position/size, or when the patches are not cheaper
+class DeltaEncoder:
+    def __init__(self):
+        self._previousBits = None
+        self._previousPosition = None
+
+    def reset(self):
+        self._previousBits = None
+        self._previousPosition = None
+
+    # set the frame the panel is known to show, so the next frame is encoded as patches from it
+    def setPreviousFrame(self, bits, x0=0, y0=0):
+        self._previousBits = bits.copy()
+        self._previousPosition = (x0, y0)
+
+    # returns a list of commands that update the panel from the previous frame to this one
+    def encode(self, bits, x0=0, y0=0):
+        height, width = bits.shape
+        previousBits = self._previousBits
+        samePlace = previousBits is not None and previousBits.shape == bits.shape and self._previousPosition == (x0, y0)
+        self._previousBits = bits.copy()
+        self._previousPosition = (x0, y0)
+        if not samePlace:
+            return [bitArrayToBitmapCommand(bits, x0, y0)]
+
+        commands = [bitArrayToBitmapCommand(bits[rowStart:rowEnd, colStart:colEnd], x0 + colStart, y0 + rowStart)
+                    for rowStart, rowEnd, colStart, colEnd in findDirtyBoxes(bits != previousBits)]
+
+        if sum(len(command) for command in commands) >= bitmapCommandSize(width, height):
+            return [bitArrayToBitmapCommand(bits, x0, y0)]
+        return commands
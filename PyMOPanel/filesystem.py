@@ -1,24 +1,127 @@
 from enum import Enum
-from sys import stdout
+from collections import deque
+import itertools
+from threading import Lock
+from typing import Final
+from PIL import Image
+import numpy as np
 from .font import Font
-from .helpers import useHighSpeedDecorator
+from .bitmap import imageToBitArray
+from .helpers import useHighSpeedDecorator, TransferStatistics
+from .receiver import fixedLengthParser, lengthPrefixedParser
 
 class FileType(Enum):
     FONT   = 0
     BITMAP = 1
 
 class Filesystem:
+    FILESYSTEM_SIZE: Final[int] = 16384
+    MAX_FILE_ID:     Final[int] = 127
+    # bytes sent ahead before checking their echo when uploading
+    UPLOAD_WINDOW_SIZE: Final[int] = 16
+    DOWNLOAD_CHUNK_SIZE: Final[int] = 256
     def __init__(self, panel):
         self._panel = panel
+        self._lastTransferStatistics = None
+        # cached directory ({FileType: {fileId: fileSize}}) and free space, None while unknown. They are kept
+        # up to date by the methods of this class that modify the filesystem
+        self._index = None
+        self._freeBytes = None
+        self._indexLock = Lock()
+
+    # TransferStatistics of the last upload or download
+    def getLastTransferStatistics(self):
+        return self._lastTransferStatistics
+
+    # the async queries always ask the panel, and update the cache with the response
+    def freeAsync(self):
+        future = self._panel.query([0xfe, 0xaf], fixedLengthParser(4, lambda response: int.from_bytes(response, byteorder='little', signed=False)))
+        future.add_done_callback(self._storeFree)
+        return future
 
     def free(self):
-        self._panel.writeBytes([0xfe, 0xaf])
-        return int.from_bytes(self._panel.readBytes(4), byteorder='little', signed=False)
-    
+        with self._indexLock:
+            if self._freeBytes is not None:
+                return self._freeBytes
+        return self.freeAsync().result()
+
+    def lsAsync(self):
+        future = self._panel.query([0xfe, 0xb3], lengthPrefixedParser(1, 4, Filesystem._parseDirectory))
+        future.add_done_callback(self._storeIndex)
+        return future
+
     def ls(self):
-        self._panel.writeBytes([0xfe, 0xb3])
-        entriesCount = self._panel.readBytes(1)[0]
-        buffer = self._panel.readBytes(4 * entriesCount)
+        with self._indexLock:
+            if self._index is not None:
+                return [{'file_type' : fileType,
+                         'file_index': fileId,
+                         'file_size' : fileSize} for fileType, files in self._index.items() for fileId, fileSize in files.items()]
+        return self.lsAsync().result()
+
+    # drop the cached directory and free space, e.g. after modifying the panel filesystem by other means
+    def invalidateIndex(self):
+        with self._indexLock:
+            self._index = None
+            self._freeBytes = None
+
+    # query the directory and free space again, in one round trip
+    def refreshIndex(self):
+        self.invalidateIndex()
+        with self._panel.batch():
+            entries = self.lsAsync()
+            freeBytes = self.freeAsync()
+        return entries.result(), freeBytes.result()
+
+    def getFontIds(self):
+        return list(self._getIndex()[FileType.FONT])
+
+    def getBitmapIds(self):
+        return list(self._getIndex()[FileType.BITMAP])
+
+    def exists(self, fileType, fileId):
+        return fileId in self._getIndex()[fileType]
+
+    # size of a file, or None if it does not exist
+    def getFileSize(self, fileType, fileId):
+        return self._getIndex()[fileType].get(fileId)
+
+    def _getIndex(self):
+        while True:
+            with self._indexLock:
+                if self._index is not None:
+                    return self._index
+            self.lsAsync().result()
+
+    def _storeIndex(self, future):
+        if future.cancelled() or future.exception():
+            return
+        index = {fileType: {} for fileType in FileType}
+        for entry in future.result():
+            index[entry['file_type']][entry['file_index']] = entry['file_size']
+        with self._indexLock:
+            self._index = index
+
+    def _storeFree(self, future):
+        if future.cancelled() or future.exception():
+            return
+        with self._indexLock:
+            self._freeBytes = future.result()
+
+    # set the size of a file in the cached directory (None removes it). The free space is queried again when
+    # needed, as the filesystem uses more space than the files size
+    def _updateIndex(self, fileType, fileId, fileSize):
+        with self._indexLock:
+            if self._index is not None:
+                if fileSize is None:
+                    self._index[fileType].pop(fileId, None)
+                else:
+                    self._index[fileType][fileId] = fileSize
+            self._freeBytes = None
+
+    # response of ls: entries count, and 4 bytes per entry
+    def _parseDirectory(response):
+        entriesCount = response[0]
+        buffer = response[1:]
         entries = []
         for entryNumber in range(entriesCount):
             offset = entryNumber * 4
@@ -40,62 +143,140 @@ class Filesystem:
                          'file_size' : fileSize}]
         return entries
         
+    # generator of the content of a file in chunks of up to chunkSize bytes. The download can be stopped at any chunk,
+    # and raises ShortReadError if the panel sends less data than announced. It does not switch to high speed
+    def iterDownloadFile(self, fileType, fileId, chunkSize = DOWNLOAD_CHUNK_SIZE, progressCallback = None):
+        return self._iterDownload([0xfe, 0xb2, fileType.value, fileId], chunkSize, progressCallback)
+
+    def iterDownloadFS(self, chunkSize = DOWNLOAD_CHUNK_SIZE, progressCallback = None):
+        self._panel.resetInputState()
+        return self._iterDownload([0xfe, 0x30], chunkSize, progressCallback)
+
+    def _iterDownload(self, command, chunkSize, progressCallback):
+        stream = self._panel.queryStream(command, 4, chunkSize)
+        statistics = TransferStatistics(stream.getSize(), progressCallback)
+        self._lastTransferStatistics = statistics
+        transferredBytes = 0
+        try:
+            for chunk in stream.chunks():
+                transferredBytes += len(chunk)
+                statistics.update(transferredBytes)
+                yield chunk
+        finally:
+            statistics.finish(transferredBytes == statistics.getTotalBytes())
+
+    # write the chunks to outputFilename (if given) as they arrive, and into a preallocated buffer if keepBuffer
+    def _download(self, chunks, outputFilename, keepBuffer = True):
+        outputFile = open(outputFilename, 'wb') if outputFilename else None
+        buffer = bytearray(self._lastTransferStatistics.getTotalBytes()) if keepBuffer else None
+        offset = 0
+        try:
+            for chunk in chunks:
+                if keepBuffer:
+                    buffer[offset:offset+len(chunk)] = chunk
+                offset += len(chunk)
+                if outputFile:
+                    outputFile.write(chunk)
+        finally:
+            if outputFile:
+                outputFile.close()
+        return bytes(buffer) if keepBuffer else None
+
     @useHighSpeedDecorator 
-    def downloadFile(self, fileType, fileId, outputFilename = None):
-        self._panel.writeBytes([0xfe, 0xb2, fileType.value, fileId])
-        fileSizeInBytes = int.from_bytes(self._panel.readBytes(4), byteorder='little', signed=False)
-        if fileSizeInBytes == 0:
+    def downloadFile(self, fileType, fileId, outputFilename = None, progressCallback = None):
+        chunks = self.iterDownloadFile(fileType, fileId, progressCallback=progressCallback)
+        # start the download to get the file size
+        firstChunk = next(chunks, b'')
+        if self._lastTransferStatistics.getTotalBytes() == 0:
             print("File size == 0! Aborting download")
             return
 
-        buffer = self._panel.readBytes(fileSizeInBytes)
         if outputFilename:
             print('Downloading {} {} from panel filesystem to {}...'.format(fileType.name, fileId, outputFilename))
-            open(outputFilename, 'wb').write(buffer)
+        buffer = self._download(itertools.chain([firstChunk], chunks), outputFilename)
+        if outputFilename:
             print('done!')
         return  buffer
 
+    # upload protocol: the panel confirms the header with 0x01, then echoes each data byte, which is confirmed with 0x01.
+    # Bytes are pipelined: windows of windowSize bytes (each followed by its confirmation) are sent before checking
+    # the echoes of the previous window. As the bytes are confirmed before checking their echo, on a mismatch the
+    # upload is aborted and restarted with half the window size. Returns the TransferStatistics
     @useHighSpeedDecorator 
-    def _upload(self, header, data):
-        self._panel.resetInputState()
+    def _upload(self, header, data, windowSize = None, progressCallback = None, maxRetries = 3):
+        statistics = TransferStatistics(len(data), progressCallback)
+        self._lastTransferStatistics = statistics
         if len(header) == 0 or len(data) == 0:
             print("empty header or data. aborting upload")
-            return
+            return statistics.finish(False)
+        windowSize = windowSize if windowSize else Filesystem.UPLOAD_WINDOW_SIZE
         #print("header: {} . len(data): {}".format(header, len(data)))
-        def expectKey(panel, expectedKey):
-            readKey = panel.readBytes(1)
-            #print("{} {}".format(readKey,expectedKey))
-            return readKey == expectedKey
+        while True:
+            succeeded, panelAborted = self._uploadWithWindow(header, data, windowSize, statistics)
+            if succeeded or panelAborted or statistics.getRetries() >= maxRetries:
+                return statistics.finish(succeeded)
+            windowSize = max(1, windowSize // 2)
+            statistics.addRetry()
+            print("error uploading file. Retrying with a window of {} bytes".format(windowSize))
 
+    # returns (succeeded, panelAborted)
+    def _uploadWithWindow(self, header, data, windowSize, statistics):
+        self._panel.resetInputState()
+        statistics.update(0)
         # send header and expect the confirmation byte
-        self._panel.writeBytes(header)
-        if not expectKey(self._panel, b'\x01'):
+        try:
+            confirmation = self._panel.query(header, fixedLengthParser(1)).result()
+        except TimeoutError:
+            confirmation = None
+        if confirmation != b'\x01':
             print("Panel aborted uploading")
-            return False
+            return False, True
 
         # here the manual says to send a 0x01, but it gets echoed by the panel, and then a byte is missing at the end, so apparently it is an error.
-    
-        # send data byte per byte, check the echoed byte from the panel, and send a confirmation byte before sending the next one from the buffer
-        for i,b in enumerate(data):
-            #print(i)
-            # each 10 bytes update progress bar
-            if i%10 == 0:
-                 stdout.write('.')
-            #    stdout.write("[{:{}}] {:.1f}%".format("="*i, 10, (100/10)*i))
-                 stdout.flush()
-            self._panel.writeBytes(b.to_bytes(length=1, byteorder='little'))
-            if not expectKey(self._panel, b.to_bytes(length=1, byteorder='little')):
-                print("error uploading file")
+
+        confirmedWindows = deque()
+        def checkOldestWindow():
+            offset, future = confirmedWindows.popleft()
+            try:
+                echoedBytes = future.result()
+            except TimeoutError:
+                echoedBytes = b''
+            if echoedBytes != data[offset:offset+len(echoedBytes)] or len(echoedBytes) == 0:
                 return False
-            self._panel.writeBytes(b'\x01')
-        print("")
-        return True
-
-    def uploadFont(self, inputFilename, fileId):
-        # TODO bitmap: [0xfe, 0x54, refId, size, data]
-        #if fileType == FileType.BITMAP:
-        #    print("bitmap uploading not supported yet")
-        #    return
+            statistics.update(offset + len(echoedBytes))
+            return True
+
+        for offset in range(0, len(data), windowSize):
+            window = data[offset:offset+windowSize]
+            command = bytearray(2 * len(window))
+            command[0::2] = window
+            command[1::2] = b'\x01' * len(window)
+            confirmedWindows.append((offset, self._panel.query(command, fixedLengthParser(len(window)))))
+            # keep up to two windows in flight
+            if len(confirmedWindows) > 1 and not checkOldestWindow():
+                self._abortUpload(confirmedWindows)
+                return False, False
+        while confirmedWindows:
+            if not checkOldestWindow():
+                self._abortUpload(confirmedWindows)
+                return False, False
+        return True, False
+
+    # wait for the bytes in flight, and then send a byte and reject it, so the panel stops the upload
+    def _abortUpload(self, confirmedWindows):
+        for _, future in confirmedWindows:
+            try:
+                future.result()
+            except TimeoutError:
+                pass
+        confirmedWindows.clear()
+        try:
+            self._panel.query(b'\x08', fixedLengthParser(1)).result()
+        except TimeoutError:
+            pass
+        self._panel.writeBytes(b'\x08')
+
+    def uploadFont(self, inputFilename, fileId, windowSize = None, progressCallback = None):
         fileBuffer = open(inputFilename,'rb').read()
         font = Font.fromBuffer(fileBuffer)
         bufferToWrite=font.toBuffer()
@@ -103,33 +284,66 @@ class Filesystem:
         assert bufferToWrite == fileBuffer
         assert font.getBufferSize() == len(fileBuffer)
         header = bytes([0xfe, 0x24]) +int(fileId).to_bytes(length=1,byteorder='little') + len(fileBuffer).to_bytes(length=2, byteorder='little')
-        return self._upload(header, bufferToWrite)
+        statistics = self._upload(header, bufferToWrite, windowSize, progressCallback)
+        # a failed upload may leave an incomplete file
+        self._updateIndex(FileType.FONT, fileId, len(bufferToWrite) if statistics else None)
+        self._panel.fonts.invalidate(fileId)
+        return statistics
     
+    # upload a (height, width) array of 1 bit pixels as a bitmap file: width, height and the packed pixels
+    def uploadBitmap(self, bits, fileId, windowSize = None, progressCallback = None):
+        height, width = bits.shape
+        bufferToWrite = bytes([width, height]) + np.packbits(bits, axis=None).tobytes()
+        header = bytes([0xfe, 0x5e]) + int(fileId).to_bytes(length=1,byteorder='little') + len(bufferToWrite).to_bytes(length=2, byteorder='little')
+        statistics = self._upload(header, bufferToWrite, windowSize, progressCallback)
+        self._updateIndex(FileType.BITMAP, fileId, len(bufferToWrite) if statistics else None)
+        return statistics
+
+    def uploadBitmapFile(self, inputFilename, fileId, thresholdForBW=50, inverted=False):
+        return self.uploadBitmap(imageToBitArray(Image.open(inputFilename), thresholdForBW, inverted), fileId)
+
     def mv(self, oldType, oldId, newType, newId):
         self._panel.writeBytes([0xfe, 0xb4, oldType.value, oldId, newType.value, newId])
+        with self._indexLock:
+            if self._index is not None and oldId in self._index[oldType]:
+                self._index[newType][newId] = self._index[oldType].pop(oldId)
+            else:
+                self._index = None
+        for fileType, fileId in ((oldType, oldId), (newType, newId)):
+            if fileType == FileType.FONT:
+                self._panel.fonts.invalidate(fileId)
     
     def rm(self, fileType, refId):
         self._panel.writeBytes([0xfe, 0xad, fileType.value, refId])
+        self._updateIndex(fileType, refId, None)
+        if fileType == FileType.FONT:
+            self._panel.fonts.invalidate(refId)
 
     @useHighSpeedDecorator 
-    def downloadFS(self, outputFilename):
-        self._panel.resetInputState()
-        self._panel.writeBytes([0xfe, 0x30])
-        filesystemSize = int.from_bytes(self._panel.readBytes(4), byteorder='little', signed=False)
+    def downloadFS(self, outputFilename, progressCallback = None):
+        chunks = self.iterDownloadFS(progressCallback=progressCallback)
+        firstChunk = next(chunks, b'')
         print('Dumping panel filesystem to {}...'.format(outputFilename))
-        open(outputFilename, 'wb').write(self._panel.readBytes(filesystemSize))
+        self._download(itertools.chain([firstChunk], chunks), outputFilename, keepBuffer=False)
         print('done!')
 
-    def uploadFS(self, inputFilename):
+    def uploadFS(self, inputFilename, windowSize = None, progressCallback = None):
         bufferToWrite = open(inputFilename, 'rb').read()
         bufferSize = len(bufferToWrite)
         print( bufferSize)
-        assert bufferSize <= 16384
+        assert bufferSize <= Filesystem.FILESYSTEM_SIZE
         header = bytes([0xfe, 0xb0]) + bufferSize.to_bytes(length=4, byteorder='little')
-        return self._upload(header, bufferToWrite)
+        statistics = self._upload(header, bufferToWrite, windowSize, progressCallback)
+        self.invalidateIndex()
+        self._panel.fonts.invalidate()
+        return statistics
     
     def wipeFS(self):
         self._panel.writeBytes([0xfe, 0x21, 0x59, 0x21])
+        with self._indexLock:
+            self._index = {fileType: {} for fileType in FileType}
+            self._freeBytes = None
+        self._panel.fonts.invalidate()
     
     def writeCustomerData(self, data):
         expectedLength = 16
@@ -143,7 +357,9 @@ class Filesystem:
             data = bytes(data, 'UTF-8')
         self._panel.writeBytes(bytes([0xfe, 0x34]) + data)
 
-    def readCustomerData(self):
+    def readCustomerDataAsync(self):
         expectedLength = 16
-        self._panel.writeBytes([0xfe, 0x35])
-        return self._panel.readBytes(16)
+        return self._panel.query([0xfe, 0x35], fixedLengthParser(expectedLength))
+
+    def readCustomerData(self):
+        return self.readCustomerDataAsync().result()
@@ -1,18 +1,33 @@
 import numpy as np
-from math import ceil
 import pprint
 
+# font as stored in the panel filesystem: a 4 bytes header (nominal width, height, first and last ascii values),
+# a table with the data offset (2 bytes, big endian) and width (1 byte) of each char, and the data of each char
+# (height * width bits, padded to a byte). The data of all the chars is kept in one buffer, and the table in a
+# structured numpy array with the offsets in that buffer
 class Font:
+    TABLE_DTYPE = np.dtype([('offset', np.uint32), ('width', np.uint8)])
+
     class Char:
         def __init__(self, width, data):
             self._width = width
             self._data  = data
 
+        def getWidth(self):
+            return self._width
+
+        def getData(self):
+            return self._data
+
     def __init__(self):
         self._nominal_width = 0
         self._height        = 0
         self._ascii_range   = [None, None]
-        self._chars         = []
+        self._data          = b''
+        self._table         = np.zeros(0, dtype=Font.TABLE_DTYPE)
+        # materialized on first use by getBitAtlas()
+        self._bitAtlas      = None
+        self._atlasOffsets  = None
 
     def getNominalWidth(self):
         return self._nominal_width
@@ -20,13 +35,44 @@ class Font:
     def getHeight(self):
         return self._height
 
+    def getAsciiRange(self):
+        return tuple(self._ascii_range)
+
     def getCharsCount(self):
-        assert len(self._chars) == 1 + self._ascii_range[1] - self._ascii_range[0]
-        return len(self._chars)
+        assert len(self._table) == 1 + self._ascii_range[1] - self._ascii_range[0]
+        return len(self._table)
 
     def getChar(self, charIndex):
-        assert charIndex < len(self._chars)
-        return self._chars[charIndex]
+        return self.Char(int(self._table['width'][charIndex]), self.getGlyphData(charIndex))
+
+    # width of each char, as a numpy array indexed by char index
+    def getCharWidths(self):
+        return self._table['width']
+
+    # packed data of a char, without copying
+    def getGlyphData(self, charIndex):
+        assert charIndex < len(self._table)
+        offset = int(self._table['offset'][charIndex])
+        return memoryview(self._data)[offset:offset + self._getGlyphSizes()[charIndex]]
+
+    # (height, width) bits of a char, as a view of the bit atlas
+    def getGlyphBits(self, charIndex):
+        atlas = self.getBitAtlas()
+        return atlas[:, self._atlasOffsets[charIndex]:self._atlasOffsets[charIndex + 1]]
+
+    # (height, sum of char widths) array with the bits of all the chars side by side, in char index order
+    def getBitAtlas(self):
+        if self._bitAtlas is None:
+            widths = self._table['width'].astype(np.int64)
+            self._atlasOffsets = np.zeros(len(widths) + 1, dtype=np.int64)
+            np.cumsum(widths, out=self._atlasOffsets[1:])
+            # for each atlas column, its char and the index of its first bit in the data
+            columnChars = np.repeat(np.arange(len(widths)), widths)
+            columnInChar = np.arange(self._atlasOffsets[-1]) - self._atlasOffsets[columnChars]
+            firstBits = self._table['offset'][columnChars].astype(np.int64) * 8 + columnInChar
+            bitIndexes = firstBits + np.arange(self._height)[:, np.newaxis] * widths[columnChars]
+            self._bitAtlas = np.unpackbits(np.frombuffer(self._data, dtype=np.uint8))[bitIndexes]
+        return self._bitAtlas
 
     def getHeaderSize(self):
         return 4
@@ -35,34 +81,21 @@ class Font:
         return self.getCharsCount() * 3
 
     def getBufferSize(self):
-        return self.getHeaderSize() + self.getCharTableSize() + sum([len(char._data) for char in self._chars])
+        return self.getHeaderSize() + self.getCharTableSize() + len(self._data)
+
+    def _getGlyphSizes(self):
+        return (self._table['width'].astype(np.int64) * self._height + 7) // 8
 
     def toBuffer(self):
-        outputBuffer = bytearray(self.getBufferSize())
-        bufferIndex = 0
-        # header
-        outputBuffer[bufferIndex] = self._nominal_width 
-        bufferIndex += 1
-        outputBuffer[bufferIndex] = self._height
-        bufferIndex += 1
-        outputBuffer[bufferIndex] = self._ascii_range[0] 
-        bufferIndex += 1
-        outputBuffer[bufferIndex] = self._ascii_range[1] 
-        bufferIndex += 1
-
-        # now populate both the chars data and tables
-        char_table_offset = bufferIndex
-        char_data_offset  = bufferIndex + self.getCharTableSize()
-        for char in self._chars:
-            outputBuffer[char_table_offset:char_table_offset+2] = int(char_data_offset).to_bytes(length=2, byteorder='big')
-            char_table_offset += 2
-            outputBuffer[char_table_offset] = char._width
-            char_table_offset += 1
-            data_size = len(char._data)
-            outputBuffer[char_data_offset:char_data_offset+data_size] = char._data
-            char_data_offset += data_size
-        return bytes(outputBuffer)
-        
+        header = bytes([self._nominal_width, self._height, self._ascii_range[0], self._ascii_range[1]])
+        charTable = np.empty((self.getCharsCount(), 3), dtype=np.uint8)
+        offsets = self._table['offset'] + self.getHeaderSize() + self.getCharTableSize()
+        assert len(offsets) == 0 or offsets.max() <= 0xffff
+        charTable[:, 0] = offsets >> 8
+        charTable[:, 1] = offsets & 0xff
+        charTable[:, 2] = self._table['width']
+        return header + charTable.tobytes() + bytes(self._data)
+
     def toDictOfUnpackedNumpyArray(self):
         myChars = { 'nominal_width': self._nominal_width,
                     'height': self._height,
@@ -71,13 +104,11 @@ class Font:
                     'chars': {}
                     }
 
-        for i,char in enumerate(self._chars):
-            if not char._width: 
-                return
-            bitsPerChar =int(self._height * char._width)
-            # decode char
-            rawBitsIncludingZeroPadding = np.unpackbits(np.frombuffer(char._data, dtype=np.uint8), axis=0)
-            myChars['chars'][chr(self._ascii_range[0] + i)] = rawBitsIncludingZeroPadding[:bitsPerChar].reshape(-1, char._width)
+        if not self._table['width'].all():
+            return
+        atlas = self.getBitAtlas()
+        for i in range(len(self._table)):
+            myChars['chars'][chr(self._ascii_range[0] + i)] = atlas[:, self._atlasOffsets[i]:self._atlasOffsets[i+1]].copy()
         return myChars
 
     def saveDictOfUnpackedNumpyArray(self, outputFilename):
@@ -86,27 +117,43 @@ class Font:
     def fromBuffer(inputBuffer):
         if not inputBuffer or len(inputBuffer) == 0:
             print("Aborting font import of empty buffer")
-            return 
+            return
+        font = Font.fromHeader(inputBuffer)
+        if not font:
+            return
+        charsCount = font._ascii_range[1] + 1 - font._ascii_range[0]
+        buffer = np.frombuffer(inputBuffer, dtype=np.uint8)
+        charTable = buffer[4:4 + 3 * charsCount].reshape(-1, 3)
+        sourceOffsets = (charTable[:, 0].astype(np.int64) << 8) | charTable[:, 1]
+        font._table = np.zeros(len(charTable), dtype=Font.TABLE_DTYPE)
+        font._table['width'] = charTable[:, 2]
+        sizes = font._getGlyphSizes()
+        offsets = np.zeros(len(sizes), dtype=np.int64)
+        np.cumsum(sizes[:-1], out=offsets[1:])
+        font._table['offset'] = offsets
+        dataSize = int(sizes.sum())
+        dataStart = 4 + 3 * charsCount
+        if np.array_equal(sourceOffsets, offsets + dataStart) and dataStart + dataSize <= len(buffer):
+            # the usual layout, with the chars data consecutive and in order
+            font._data = bytes(buffer[dataStart:dataStart + dataSize])
+        else:
+            # gather the data of each char. Missing bytes of a truncated buffer are zeros
+            sourceIndexes = np.repeat(sourceOffsets - offsets, sizes) + np.arange(dataSize)
+            padded = np.zeros(max(len(buffer), int(sourceIndexes.max(initial=0)) + 1), dtype=np.uint8)
+            padded[:len(buffer)] = buffer
+            font._data = padded[sourceIndexes].tobytes()
+        return font
+
+    # font with only the header attributes (nominal width, height and ascii range), and no chars
+    def fromHeader(inputBuffer):
+        if not inputBuffer or len(inputBuffer) < 4:
+            print("Aborting font header import of short buffer")
+            return
         font = Font()
-        bufferIndex = 0
-        font._nominal_width  = inputBuffer[bufferIndex]
-        bufferIndex += 1
-        font._height         = inputBuffer[bufferIndex]
-        bufferIndex += 1
-        font._ascii_range[0] = inputBuffer[bufferIndex]
-        bufferIndex += 1
-        font._ascii_range[1] = inputBuffer[bufferIndex]
-        bufferIndex += 1
-        font._chars = []
-        for ch in range(font._ascii_range[0], font._ascii_range[1]+1):
-            offset = int.from_bytes(inputBuffer[bufferIndex:bufferIndex+2], byteorder='big')
-            bufferIndex += 2
-            char_width = inputBuffer[bufferIndex]
-            bufferIndex += 1
-            bitsPerChar =int(font._height * char_width)
-            bytesPerChar = ceil(bitsPerChar / 8.)
-            thisCharData = inputBuffer[offset:offset+bytesPerChar] 
-            font._chars += [ font.Char(char_width, thisCharData) ]
+        font._nominal_width  = inputBuffer[0]
+        font._height         = inputBuffer[1]
+        font._ascii_range[0] = inputBuffer[2]
+        font._ascii_range[1] = inputBuffer[3]
         return font
 
     def fromDictOfUnpackedNumpyArray(dictOfNpArrays):
@@ -114,11 +161,22 @@ class Font:
         font._nominal_width = dictOfNpArrays['nominal_width']
         font._height = dictOfNpArrays['height']
         font._ascii_range = [dictOfNpArrays['ascii_start_value'], dictOfNpArrays['ascii_end_value']]
-        font._chars = []
-        for npChar in dictOfNpArrays['chars'].values():
-           font._chars += [ font.Char(npChar.shape[1], bytes(np.packbits(npChar))) ]
+        npChars = list(dictOfNpArrays['chars'].values())
+        font._table = np.zeros(len(npChars), dtype=Font.TABLE_DTYPE)
+        font._table['width'] = [npChar.shape[1] for npChar in npChars]
+        bitsCounts = np.array([npChar.size for npChar in npChars], dtype=np.int64)
+        sizes = (bitsCounts + 7) // 8
+        offsets = np.zeros(len(sizes), dtype=np.int64)
+        np.cumsum(sizes[:-1], out=offsets[1:])
+        font._table['offset'] = offsets
+        # the bits of each char start at a byte boundary
+        bits = np.zeros(int(sizes.sum()) * 8, dtype=np.uint8)
+        if len(npChars):
+            bitIndexes = np.arange(bitsCounts.sum()) + np.repeat(offsets * 8 - (np.cumsum(bitsCounts) - bitsCounts), bitsCounts)
+            bits[bitIndexes] = np.concatenate([npChar.ravel() for npChar in npChars])
+        font._data = np.packbits(bits).tobytes()
         return font
-            
+
     def fromRawDataFile(inputFilename):
         buffer = open(inputFilename, 'rb').read()
         return Font.fromBuffer(buffer)
@@ -0,0 +1,94 @@
+import glob
+import os
+from collections import OrderedDict
+from threading import Lock
+from .filesystem import FileType
+from .font import Font
+
+# decodes each font of the panel filesystem once, and keeps the Font objects in a LRU of up to maxFonts entries.
+# With a cacheDirectory, the downloaded fonts are also saved there (keyed by font id and file size, as in the
+# filesystem index) so they are not downloaded again after a restart
+class FontManager:
+    DEFAULT_MAX_FONTS = 8
+
+    def __init__(self, panel, maxFonts = DEFAULT_MAX_FONTS, cacheDirectory = None):
+        self._panel = panel
+        self._maxFonts = maxFonts
+        self._fonts = OrderedDict()     # fontId -> (fileSize, font)
+        self._lock = Lock()
+        self._cacheDirectory = None
+        self.setCacheDirectory(cacheDirectory)
+
+    def setCacheDirectory(self, cacheDirectory):
+        if cacheDirectory:
+            os.makedirs(cacheDirectory, exist_ok=True)
+        self._cacheDirectory = cacheDirectory
+
+    def getCacheDirectory(self):
+        return self._cacheDirectory
+
+    def getCachedFontsCount(self):
+        return len(self._fonts)
+
+    # Font selected with Text.selectCurrentFont, or None if it is not in the panel filesystem
+    def getCurrentFont(self):
+        return self.getFont(self._panel.text.getCurrentFont())
+
+    # Font with id fontId, or None if it is not in the panel filesystem
+    def getFont(self, fontId):
+        fileSize = self._panel.fs.getFileSize(FileType.FONT, fontId)
+        if not fileSize:
+            return None
+        with self._lock:
+            if fontId in self._fonts and self._fonts[fontId][0] == fileSize:
+                self._fonts.move_to_end(fontId)
+                return self._fonts[fontId][1]
+        font = self._loadFromDisk(fontId, fileSize)
+        if font is None:
+            buffer = self._panel.fs.downloadFile(FileType.FONT, fontId)
+            font = Font.fromBuffer(buffer)
+            if font is None:
+                return None
+            self._saveToDisk(fontId, fileSize, buffer)
+        with self._lock:
+            self._fonts[fontId] = (fileSize, font)
+            self._fonts.move_to_end(fontId)
+            while len(self._fonts) > self._maxFonts:
+                self._fonts.popitem(last=False)
+        return font
+
+    # forget a font (or all of them if fontId is None), also from the cache directory. Called by Filesystem when
+    # fonts are uploaded, moved or removed
+    def invalidate(self, fontId = None):
+        with self._lock:
+            if fontId is None:
+                self._fonts.clear()
+            else:
+                self._fonts.pop(fontId, None)
+        if not self._cacheDirectory:
+            return
+        for path in glob.glob(os.path.join(self._cacheDirectory, 'font_{}_*.data'.format('*' if fontId is None else fontId))):
+            os.remove(path)
+
+    def _getPath(self, fontId, fileSize):
+        return os.path.join(self._cacheDirectory, 'font_{}_{}.data'.format(fontId, fileSize))
+
+    # fonts are stored in the same raw format used by Font.fromRawDataFile
+    def _saveToDisk(self, fontId, fileSize, buffer):
+        if not self._cacheDirectory:
+            return
+        path = self._getPath(fontId, fileSize)
+        with open(path + '.tmp', 'wb') as outputFile:
+            outputFile.write(buffer)
+        os.replace(path + '.tmp', path)
+
+    def _loadFromDisk(self, fontId, fileSize):
+        if not self._cacheDirectory:
+            return None
+        path = self._getPath(fontId, fileSize)
+        if not os.path.exists(path):
+            return None
+        if os.path.getsize(path) != fileSize:
+            print("Ignoring corrupted cached font {}".format(path))
+            return None
+        return Font.fromRawDataFile(path)
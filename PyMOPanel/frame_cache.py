@@ -0,0 +1,100 @@
+import hashlib
+import mmap
+import os
+import numpy as np
+from collections import OrderedDict
+from threading import Lock
+
+# cache of ready to send 0xfe 0x64 command buffers for each frame of a bitmap/animation. Entries are kept in an in
+# memory LRU limited by a byte budget, and optionally persisted in a directory, where they are memory-mapped on load
+class FrameCache:
+    def __init__(self, maxBytes = 4*1024*1024, cacheDirectory = None):
+        self._maxBytes = maxBytes
+        self._usedBytes = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._cacheDirectory = cacheDirectory
+        if cacheDirectory:
+            os.makedirs(cacheDirectory, exist_ok=True)
+
+    # key from the file content plus the conversion parameters
+    def makeKey(inputFilename, x0, y0, thresholdForBW, inverted):
+        contentHash = hashlib.sha1()
+        with open(inputFilename, 'rb') as inputFile:
+            for chunk in iter(lambda: inputFile.read(65536), b''):
+                contentHash.update(chunk)
+        return '{}_{}_{}_{}_{}'.format(contentHash.hexdigest(), x0, y0, thresholdForBW, int(bool(inverted)))
+
+    def getUsedBytes(self):
+        return self._usedBytes
+
+    def getMaxBytes(self):
+        return self._maxBytes
+
+    # returns the list of frame buffers, or None if not cached
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        frames = self._loadFromDisk(key)
+        if frames is not None:
+            self._addToMemory(key, frames)
+        return frames
+
+    def put(self, key, frames):
+        frames = [bytes(frame) for frame in frames]
+        self._addToMemory(key, frames)
+        self._saveToDisk(key, frames)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._usedBytes = 0
+
+    def _addToMemory(self, key, frames):
+        entrySize = sum(len(frame) for frame in frames)
+        with self._lock:
+            if key in self._entries:
+                self._usedBytes -= sum(len(frame) for frame in self._entries.pop(key))
+            if entrySize > self._maxBytes:
+                return
+            self._entries[key] = frames
+            self._usedBytes += entrySize
+            while self._usedBytes > self._maxBytes:
+                _, evictedFrames = self._entries.popitem(last=False)
+                self._usedBytes -= sum(len(frame) for frame in evictedFrames)
+
+    def _getPaths(self, key):
+        basename = os.path.join(self._cacheDirectory, key)
+        return basename + '.frames', basename + '.index.npy'
+
+    # frames are stored concatenated in <key>.frames, and their offsets in <key>.index.npy
+    def _saveToDisk(self, key, frames):
+        if not self._cacheDirectory:
+            return
+        framesPath, indexPath = self._getPaths(key)
+        offsets = np.zeros(len(frames) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(frame) for frame in frames])
+        with open(framesPath + '.tmp', 'wb') as framesFile:
+            for frame in frames:
+                framesFile.write(frame)
+        with open(indexPath + '.tmp', 'wb') as indexFile:
+            np.save(indexFile, offsets)
+        # the index is written last, so a frames file without index is never used
+        os.replace(framesPath + '.tmp', framesPath)
+        os.replace(indexPath + '.tmp', indexPath)
+
+    def _loadFromDisk(self, key):
+        if not self._cacheDirectory:
+            return None
+        framesPath, indexPath = self._getPaths(key)
+        if not os.path.exists(indexPath) or not os.path.exists(framesPath):
+            return None
+        offsets = np.load(indexPath)
+        if os.path.getsize(framesPath) != offsets[-1] or offsets[-1] == 0:
+            print("Ignoring corrupted cache entry {}".format(key))
+            return None
+        with open(framesPath, 'rb') as framesFile:
+            mappedFrames = memoryview(mmap.mmap(framesFile.fileno(), 0, access=mmap.ACCESS_READ))
+        return [mappedFrames[int(offsets[i]):int(offsets[i+1])] for i in range(len(offsets) - 1)]
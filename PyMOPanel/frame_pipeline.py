@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from queue import Queue, Full
+from threading import Thread, Event
+from PIL import Image
+from .bitmap import imageToBitArray, bitArrayToBitmapCommand, fitImage, getFitSize, getFrameIndexes
+
+# convert the raw data of a frame into its 0xfe 0x64 command. It runs in the pool workers, so it only gets
+# picklable arguments
+def _convertFrame(mode, size, data, fitSize, x0, y0, thresholdForBW, inverted):
+    img = Image.frombytes(mode, size, data)
+    if fitSize:
+        img = fitImage(img, *fitSize)
+    return bitArrayToBitmapCommand(imageToBitArray(img, thresholdForBW, inverted), x0, y0)
+
+# iterable of the 0xfe 0x64 commands of each frame of a bitmap (as encodeBitmapFile), converted in parallel.
+# Frames are decoded in order by a thread (gif frames depend on the previous ones), and resized, fitted and
+# converted in a pool of processes (or threads). The pending frames go through a bounded queue, so the first frame is
+# available as soon as it is converted and at most maxQueuedFrames frames are kept in memory.
+# Each iteration starts a new conversion, and stopping it early cancels the frames not converted yet
+class FramePipeline:
+    # time to wait for the queue before checking if the iteration was stopped
+    POLL_PERIOD = 0.1
+
+    def __init__(self, inputFilename, x0=0, y0=0, thresholdForBW=50, inverted=False, fit=True, workersCount=None, maxQueuedFrames=None, useProcesses=True):
+        self._inputFilename = inputFilename
+        self._x0 = x0
+        self._y0 = y0
+        self._thresholdForBW = thresholdForBW
+        self._inverted = inverted
+        self._fitSize = getFitSize(x0, y0) if fit else None
+        self._workersCount = workersCount if workersCount else os.cpu_count() or 1
+        self._maxQueuedFrames = maxQueuedFrames if maxQueuedFrames else 2 * self._workersCount
+        self._useProcesses = useProcesses
+        with Image.open(inputFilename) as img:
+            self._framesCount = len(getFrameIndexes(img))
+
+    def getFramesCount(self):
+        return self._framesCount
+
+    def __len__(self):
+        return self._framesCount
+
+    def __iter__(self):
+        # a single frame is not worth a pool
+        if self._framesCount <= 1 or self._workersCount <= 1:
+            yield from self._convertSequentially()
+            return
+        executorClass = ProcessPoolExecutor if self._useProcesses else ThreadPoolExecutor
+        pendingFrames = Queue(maxsize=self._maxQueuedFrames)
+        stopEvent = Event()
+        with executorClass(max_workers=self._workersCount) as executor:
+            decoderThread = Thread(target=self._decodeFrames, args=(executor, pendingFrames, stopEvent), daemon=True)
+            decoderThread.start()
+            try:
+                while True:
+                    future = pendingFrames.get()
+                    if future is None:
+                        break
+                    yield future.result()
+            finally:
+                stopEvent.set()
+                decoderThread.join()
+                while not pendingFrames.empty():
+                    future = pendingFrames.get_nowait()
+                    if future:
+                        future.cancel()
+
+    def _convertSequentially(self):
+        with Image.open(self._inputFilename) as img:
+            for frame in getFrameIndexes(img):
+                img.seek(frame)
+                yield _convertFrame(img.mode, img.size, img.tobytes(), self._fitSize, self._x0, self._y0, self._thresholdForBW, self._inverted)
+
+    # decode the frames in order and queue their conversion, ending with None. Errors are queued as failed futures
+    def _decodeFrames(self, executor, pendingFrames, stopEvent):
+        try:
+            with Image.open(self._inputFilename) as img:
+                for frame in getFrameIndexes(img):
+                    img.seek(frame)
+                    future = executor.submit(_convertFrame, img.mode, img.size, img.tobytes(), self._fitSize,
+                                             self._x0, self._y0, self._thresholdForBW, self._inverted)
+                    if not self._put(pendingFrames, future, stopEvent):
+                        future.cancel()
+                        return
+        except Exception as exception:
+            future = Future()
+            future.set_exception(exception)
+            self._put(pendingFrames, future, stopEvent)
+        self._put(pendingFrames, None, stopEvent)
+
+    # blocking put that gives up when stopEvent is set. Returns if it was queued
+    def _put(self, pendingFrames, item, stopEvent):
+        while not stopEvent.is_set():
+            try:
+                pendingFrames.put(item, timeout=FramePipeline.POLL_PERIOD)
+                return True
+            except Full:
+                pass
+        return False
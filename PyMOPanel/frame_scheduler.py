@@ -0,0 +1,115 @@
+import time
+from enum import Enum
+
+# what the FrameScheduler does with the frames that the link cannot send in time
+class SchedulingPolicy(Enum):
+    # late frames are not sent, so the frame shown is always the one due now
+    DROP      = 0
+    # late frames are not sent alone: their changes are sent with the next frame, as a single update
+    MERGE     = 1
+    # all the frames are sent, waiting for the link, so the playback becomes slower instead of falling behind
+    SLOW_DOWN = 2
+
+# timing of frames played at framesPerSecond, predicting when the serial link is free from the bytes sent and the
+# current baud rate (10 bits per byte: start + 8 data + stop). Writes can return before the bytes are on the wire
+# (writer thread, OS buffers), so the prediction keeps the frames from queueing up and drifting without bound.
+# Usage, for each frame: if scheduler.waitForFrame(isLastFrame): send it and call scheduler.frameSent(bytesCount)
+class FrameScheduler:
+    BITS_PER_BYTE = 10
+
+    def __init__(self, panel, framesPerSecond, policy = SchedulingPolicy.DROP, statistics = None):
+        self._panel = panel
+        self._framePeriod = 1 / framesPerSecond
+        self._policy = policy
+        self._statistics = statistics
+        self._startTimestamp = None
+        self._nextFrameTimestamp = None
+        self._sendTimestamp = None
+        self._slotEndTimestamp = None
+        self._linkFreeTimestamp = 0.
+        self._wireTime = 0.
+        self._lateFramesCount = 0
+        self._droppedFramesCount = 0
+        self._mergedFramesCount = 0
+        self._pendingMergeCount = 0
+
+    def getPolicy(self):
+        return self._policy
+
+    # seconds to send bytesCount bytes at the current baud rate
+    def getWireTime(self, bytesCount):
+        return bytesCount * FrameScheduler.BITS_PER_BYTE / self._panel.getBaudRate()
+
+    # wait until the next frame is due. Returns False if it should not be sent (DROP and MERGE policies, when its
+    # time slot ends before the link is free). The last frame is always sent
+    def waitForFrame(self, isLastFrame = False):
+        now = time.time()
+        if self._startTimestamp is None:
+            self._startTimestamp = now
+            self._nextFrameTimestamp = now
+        dueTimestamp = self._nextFrameTimestamp
+        self._nextFrameTimestamp += self._framePeriod
+        linkFreeTimestamp = max(now, self._linkFreeTimestamp)
+        if self._policy != SchedulingPolicy.SLOW_DOWN and not isLastFrame and linkFreeTimestamp >= self._nextFrameTimestamp:
+            if self._policy == SchedulingPolicy.MERGE:
+                self._pendingMergeCount += 1
+            else:
+                self._droppedFramesCount += 1
+            self._updateStatistics()
+            return False
+        self._sendTimestamp = max(dueTimestamp, linkFreeTimestamp) if self._policy == SchedulingPolicy.SLOW_DOWN else max(dueTimestamp, now)
+        self._slotEndTimestamp = dueTimestamp + self._framePeriod
+        if self._policy == SchedulingPolicy.SLOW_DOWN:
+            # the following frames keep their period from this one
+            self._nextFrameTimestamp = self._sendTimestamp + self._framePeriod
+        sleepTime = self._sendTimestamp - time.time()
+        if sleepTime > 0:
+            time.sleep(sleepTime)
+        return True
+
+    # the frame allowed by waitForFrame was sent. It is late if it is predicted to be on the wire after its time slot
+    def frameSent(self, bytesCount):
+        wireTime = self.getWireTime(bytesCount)
+        self._linkFreeTimestamp = max(self._sendTimestamp, self._linkFreeTimestamp) + wireTime
+        if self._linkFreeTimestamp > self._slotEndTimestamp:
+            self._lateFramesCount += 1
+        self._wireTime += wireTime
+        self._mergedFramesCount += self._pendingMergeCount
+        self._pendingMergeCount = 0
+        if self._statistics:
+            self._statistics.addFrame(bytesCount)
+        self._updateStatistics()
+
+    # if frames were merged into the frame to send, which then has to include their changes
+    def hasMergedFrames(self):
+        return self._pendingMergeCount > 0
+
+    def getLateFramesCount(self):
+        return self._lateFramesCount
+
+    def getDroppedFramesCount(self):
+        return self._droppedFramesCount
+
+    def getMergedFramesCount(self):
+        return self._mergedFramesCount
+
+    # seconds the link was busy sending frames
+    def getTotalWireTime(self):
+        return self._wireTime
+
+    # fraction of the playback time the link was busy
+    def getLinkUtilization(self):
+        if self._startTimestamp is None:
+            return 0.
+        elapsedTime = max(time.time(), self._linkFreeTimestamp) - self._startTimestamp
+        return min(1., self._wireTime / elapsedTime) if elapsedTime > 0 else 0.
+
+    def _updateStatistics(self):
+        if self._statistics:
+            self._statistics.setSchedulingCounts(self._lateFramesCount, self._droppedFramesCount, self._mergedFramesCount, self.getLinkUtilization())
+
+    def __repr__(self):
+        return "{} late, {} dropped, {} merged frames, {:.0f}% link utilization".format(self._lateFramesCount,
+                                                                                          self._droppedFramesCount,
+                                                                                          self._mergedFramesCount,
+                                                                                          100 * self.getLinkUtilization())
@@ -1,4 +1,5 @@
 from enum import Enum
+from .serial_writer import Lane
 
 class LedStatus(Enum):
     YELLOW = b'\0\0'
@@ -16,7 +17,9 @@ class GPO:
         self.setLed(2, led2)
 
     def setGPOState(self, gpo, value):
-        self._panel.writeBytes([0xfe, 0x56 if value == 0 else 0x57, gpo])
+        if not self._panel.shadowState.update(('gpo', gpo), bool(value)):
+            return
+        self._panel.writeBytes([0xfe, 0x56 if value == 0 else 0x57, gpo], Lane.INTERACTIVE)
 
     def setLed(self, led, state):
         self._leds[led] = state
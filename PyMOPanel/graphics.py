@@ -1,17 +1,104 @@
-from PIL import Image
 from typing import Final
+import numpy as np
 import time
 from .helpers import sanitizeUint8, useHighSpeedDecorator
+from .bitmap import bitmapCommandToBitArray, splitBitmapCommand
+from .serial_writer import Lane
+from .frame_cache import FrameCache
+from .frame_pipeline import FramePipeline
+from .frame_scheduler import FrameScheduler, SchedulingPolicy
+from .delta_encoder import DeltaEncoder
+
+# timing and traffic of a bitmap/animation playback
+class PlaybackStatistics:
+    def __init__(self):
+        self._startTimestamp = time.time()
+        self._endTimestamp = self._startTimestamp
+        self._framesCount = 0
+        self._bytesSent = 0
+        # set by a FrameScheduler
+        self._lateFramesCount = 0
+        self._droppedFramesCount = 0
+        self._mergedFramesCount = 0
+        self._linkUtilization = None
+
+    def addFrame(self, bytesSent):
+        self._framesCount += 1
+        self._bytesSent += bytesSent
+        self._endTimestamp = time.time()
+
+    def getFramesCount(self):
+        return self._framesCount
+
+    def getBytesSent(self):
+        return self._bytesSent
+
+    def getElapsedTime(self):
+        return self._endTimestamp - self._startTimestamp
+
+    def getFps(self):
+        elapsedTime = self.getElapsedTime()
+        return self._framesCount / elapsedTime if elapsedTime > 0 else 0.
+
+    def getBytesPerFrame(self):
+        return self._bytesSent / self._framesCount if self._framesCount else 0.
+
+    def setSchedulingCounts(self, lateFramesCount, droppedFramesCount, mergedFramesCount, linkUtilization):
+        self._lateFramesCount = lateFramesCount
+        self._droppedFramesCount = droppedFramesCount
+        self._mergedFramesCount = mergedFramesCount
+        self._linkUtilization = linkUtilization
+
+    def getLateFramesCount(self):
+        return self._lateFramesCount
+
+    def getDroppedFramesCount(self):
+        return self._droppedFramesCount
+
+    def getMergedFramesCount(self):
+        return self._mergedFramesCount
+
+    # fraction of the time the link was busy, or None if the frames were not scheduled
+    def getLinkUtilization(self):
+        return self._linkUtilization
+
+    def __repr__(self):
+        description = "{} frames, {:.2f} fps, {:.1f} bytes/frame".format(self._framesCount, self.getFps(), self.getBytesPerFrame())
+        if self._linkUtilization is None:
+            return description
+        return description + " ({} late, {} dropped, {} merged, {:.0f}% link utilization)".format(self._lateFramesCount,
+                                                                                                   self._droppedFramesCount,
+                                                                                                   self._mergedFramesCount,
+                                                                                                   100 * self._linkUtilization)
 
 class Graphics:
     PANEL_WIDTH:  Final[int] = 192
     CENTER_X:     Final[int] = int(PANEL_WIDTH/2)
     PANEL_HEIGHT: Final[int] = 64
     CENTER_Y:     Final[int] = int(PANEL_HEIGHT/2)
-    def __init__(self, panel):
+    # maximum size of the bitmap chunks queued in the bulk lane of the writer thread
+    BULK_CHUNK_SIZE: Final[int] = 256
+    def __init__(self, panel, frameCache = None):
         self._panel = panel
+        self._frameCache = frameCache if frameCache else FrameCache()
+        self._spriteCache = None
+
+    def setFrameCache(self, frameCache):
+        self._frameCache = frameCache
+
+    def getFrameCache(self):
+        return self._frameCache
+
+    # when set, the frames of uploadAndShowBitmap (without deltaEncoding) are shown through the SpriteCache
+    def setSpriteCache(self, spriteCache):
+        self._spriteCache = spriteCache
+
+    def getSpriteCache(self):
+        return self._spriteCache
 
     def setDrawingColor(self, color):
+        if not self._panel.shadowState.update('drawingColor', sanitizeUint8(color)):
+            return
         self._panel.writeBytes([0xfe, 0x63,
                          sanitizeUint8(color)])
     def drawPixel(self, x, y):
@@ -40,56 +127,180 @@ class Graphics:
                          sanitizeUint8(x1),
                          sanitizeUint8(y1)])
 
-    # show a bitmap. It could be an animated gif
+    # draw many pixels in a single write. Points out of the panel and consecutive duplicates are dropped, and
+    # runs of adjacent pixels in the same direction are sent as lines. Returns the number of bytes sent
+    def drawPixels(self, xs, ys):
+        points = np.column_stack((np.asarray(xs, dtype=int).ravel(), np.asarray(ys, dtype=int).ravel()))
+        points = points[(points[:,0] >= 0) & (points[:,0] < Graphics.PANEL_WIDTH) &
+                        (points[:,1] >= 0) & (points[:,1] < Graphics.PANEL_HEIGHT)]
+        if len(points) == 0:
+            return 0
+        points = points[np.concatenate(([True], (np.diff(points, axis=0) != 0).any(axis=1)))]
+        steps = np.diff(points, axis=0)
+        isUnitStep = (np.abs(steps).max(axis=1, initial=0) == 1).tolist()
+        steps = steps.tolist()
+        points = points.tolist()
+
+        outputArray = bytearray()
+        lastEndpoint = None
+        i = 0
+        while i < len(points):
+            if i < len(steps) and isUnitStep[i]:
+                # extend the segment while the direction is kept
+                j = i + 1
+                while j < len(steps) and isUnitStep[j] and steps[j] == steps[i]:
+                    j += 1
+                if lastEndpoint == points[i]:
+                    outputArray += bytes([0xfe, 0x65, *points[j]])
+                else:
+                    outputArray += bytes([0xfe, 0x6c, *points[i], *points[j]])
+                lastEndpoint = points[j]
+                i = j
+            else:
+                if lastEndpoint != points[i]:
+                    outputArray += bytes([0xfe, 0x70, *points[i]])
+                lastEndpoint = None
+                i += 1
+        self._panel.writeBytes(bytes(outputArray))
+        return len(outputArray)
+
+    # draw connected lines through a (N, 2) array of points in a single write. Segments are clipped to the panel,
+    # and consecutive collinear segments are merged. Returns the number of bytes sent
+    def drawPolyline(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(points) == 0:
+            return 0
+        points = points[np.concatenate(([True], (np.diff(points, axis=0) != 0).any(axis=1)))]
+        if len(points) == 1:
+            return self.drawPixels(points[:,0], points[:,1])
+
+        # Liang-Barsky clipping of all the segments
+        starts, deltas = points[:-1], np.diff(points, axis=0)
+        t0 = np.zeros(len(deltas))
+        t1 = np.ones(len(deltas))
+        visible = np.ones(len(deltas), dtype=bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for p, q in ((-deltas[:,0], starts[:,0]),
+                         ( deltas[:,0], Graphics.PANEL_WIDTH - 1 - starts[:,0]),
+                         (-deltas[:,1], starts[:,1]),
+                         ( deltas[:,1], Graphics.PANEL_HEIGHT - 1 - starts[:,1])):
+                ratio = q / p
+                visible &= (p != 0) | (q >= 0)
+                t0 = np.where(p < 0, np.maximum(t0, ratio), t0)
+                t1 = np.where(p > 0, np.minimum(t1, ratio), t1)
+        visible &= t0 <= t1
+        clippedStarts = np.rint(starts + t0[:,None] * deltas).astype(int).tolist()
+        clippedEnds   = np.rint(starts + t1[:,None] * deltas).astype(int).tolist()
+        # a segment continues the previous one if both share the unclipped vertex
+        connected = np.concatenate(([False], visible[:-1] & (t1[:-1] == 1) & (t0[1:] == 0))).tolist()
+        deltas = deltas.tolist()
+        visible = visible.tolist()
+
+        outputArray = bytearray()
+        chainStart = None
+        pendingEnd = None
+        # the first vertex of a chain is sent as a line, the next ones as line continuations
+        def sendPendingEnd():
+            nonlocal chainStart
+            if chainStart is not None:
+                outputArray.extend([0xfe, 0x6c, *chainStart, *pendingEnd])
+                chainStart = None
+            else:
+                outputArray.extend([0xfe, 0x65, *pendingEnd])
+
+        for i in range(len(deltas)):
+            if not visible[i]:
+                continue
+            if connected[i] and pendingEnd is not None:
+                previousDelta = deltas[i-1]
+                isCollinear = previousDelta[0] * deltas[i][1] == previousDelta[1] * deltas[i][0] and \
+                              previousDelta[0] * deltas[i][0] + previousDelta[1] * deltas[i][1] > 0
+                if not isCollinear:
+                    sendPendingEnd()
+            else:
+                if pendingEnd is not None:
+                    sendPendingEnd()
+                chainStart = clippedStarts[i]
+            pendingEnd = clippedEnds[i]
+        if pendingEnd is not None:
+            sendPendingEnd()
+        self._panel.writeBytes(bytes(outputArray))
+        return len(outputArray)
+
+    # show a bitmap previously uploaded to the panel filesystem
+    def showBitmap(self, refId, x0=0, y0=0):
+        self._panel.writeBytes([0xfe, 0x62,
+                         sanitizeUint8(refId),
+                         sanitizeUint8(x0),
+                         sanitizeUint8(y0)])
+
+    # write a 0xfe 0x64 command in the bulk lane. With the writer thread running, it is split in bands
+    # so higher priority commands can be sent in between
+    def writeBitmapCommand(self, command):
+        if not self._panel.isWriterThreadRunning():
+            self._panel.writeBytes(command, Lane.BULK)
+            return
+        for chunk in splitBitmapCommand(command, Graphics.BULK_CHUNK_SIZE):
+            self._panel.writeBytes(chunk, Lane.BULK)
+
+    # get the encoded frames of a bitmap, from the frame cache if available. Otherwise they are converted in parallel
+    # by a FramePipeline and streamed as they are ready, and cached once all of them are converted
+    def getBitmapFrames(self, inputFilename, x0=0, y0=0, thresholdForBW=50, inverted=False):
+        if not self._frameCache:
+            return FramePipeline(inputFilename, x0, y0, thresholdForBW, inverted)
+        key = FrameCache.makeKey(inputFilename, x0, y0, thresholdForBW, inverted)
+        frames = self._frameCache.get(key)
+        if frames is None:
+            return self._streamAndCacheFrames(FramePipeline(inputFilename, x0, y0, thresholdForBW, inverted), key)
+        return frames
+
+    def _streamAndCacheFrames(self, pipeline, key):
+        frames = []
+        for frame in pipeline:
+            frames.append(frame)
+            yield frame
+        self._frameCache.put(key, frames)
+
+    # show a bitmap. It could be an animated gif. With deltaEncoding only the changed regions of each frame are sent.
+    # Frames are timed by a FrameScheduler, and schedulingPolicy sets what to do when the link cannot send them in time.
+    # Returns the PlaybackStatistics
     @useHighSpeedDecorator
-    def uploadAndShowBitmap(self, inputFilename, x0=0, y0=0, thresholdForBW=50, inverted=False, fastBaud=True, framesPerSecond=5):
-        framePeriod = 1/framesPerSecond
-        img = Image.open(inputFilename)
-        width = img.width
-        height = img.height
-        isAnimation = hasattr(img,'n_frames')
-        frames = img.n_frames if isAnimation else 2
-
-        def getValueForAboveThreshold(bitIndex, inverted):
-            return 1<<(7-bitIndex) if inverted else 0
-        def getValueForBelowThreshold(bitIndex, inverted):
-            return getValueForAboveThreshold(bitIndex, not inverted)
-
-        def sumChannels(inputByteArray, offset, dataSize):
-            dataSize=int(dataSize)
-            sum=0
-            base = offset*dataSize
-            for i in range(dataSize):
-                sum += inputByteArray[base+i]
-            return sum/dataSize
-        nextFrameExpectedTimestamp = time.time()
-        for frame in range(1,frames):
-            if isAnimation:
-                img.seek(frame)
-                thisFrameTimestamp = time.time()
-                sleepTime = nextFrameExpectedTimestamp - thisFrameTimestamp
-                if sleepTime > 0: 
-                    time.sleep(sleepTime)
-                nextFrameExpectedTimestamp = thisFrameTimestamp + framePeriod
-                
-            bitDepth = {'1':1, 'L':8, 'P':8, 'RGB':24, 'RGBA':32, 'CMYK':32, 'YCbCr':24, 'I':32, 'F':32}[img.mode]
-            bytesPerPixel = bitDepth / 8
-
-            buffer = img.tobytes()
-            if len(buffer) % bitDepth != 0:
-                raise Exception('bitmap size should be a multiple of the used depth')
-
-            # init array with header
-            outputArray = bytearray(b'\xfe\x64')
-            outputArray += x0.to_bytes(1,'little')
-            outputArray += y0.to_bytes(1,'little')
-            outputArray += width.to_bytes(1,'little')
-            outputArray += height.to_bytes(1,'little')
-
-            # pack input 8 bit image to 1 bit monocromatic pixels
-            for pixelNr in range(0, width*height, 8):
-                baseAddrForByte = pixelNr
-                outputArray += sum([getValueForAboveThreshold(bitIndex,inverted) if sumChannels(buffer, pixelNr+bitIndex, bytesPerPixel)>=thresholdForBW else getValueForBelowThreshold(bitIndex,inverted) for bitIndex in range(8)]).to_bytes(1,'little')
-
-            # send data
-            self._panel.writeBytes(bytes(outputArray))
+    def uploadAndShowBitmap(self, inputFilename, x0=0, y0=0, thresholdForBW=50, inverted=False, fastBaud=True, framesPerSecond=5, deltaEncoding=False, schedulingPolicy=SchedulingPolicy.SLOW_DOWN):
+        statistics = PlaybackStatistics()
+        scheduler = FrameScheduler(self._panel, framesPerSecond, schedulingPolicy, statistics)
+        deltaEncoder = DeltaEncoder() if deltaEncoding else None
+        # full frames after merged ones are sent as patches of the changes since the last frame sent, if cheaper
+        mergeEncoder = DeltaEncoder() if schedulingPolicy == SchedulingPolicy.MERGE and not deltaEncoding else None
+        lastFrameBuffer = None
+        frames = self.getBitmapFrames(inputFilename, x0, y0, thresholdForBW, inverted)
+        useSprites = self._spriteCache and not deltaEncoder
+        if useSprites:
+            # sprites are uploaded before the timed loop, since the scheduler does not account for uploads
+            frames = list(frames)
+            self._spriteCache.preloadBitmapCommands(frames)
+        for frameBuffer, isLastFrame in Graphics._withLastFlag(frames):
+            if not scheduler.waitForFrame(isLastFrame):
+                continue
+            if useSprites:
+                scheduler.frameSent(self._spriteCache.showBitmapCommand(frameBuffer, upload=False))
+                continue
+            commands = deltaEncoder.encode(*bitmapCommandToBitArray(frameBuffer)) if deltaEncoder else [frameBuffer]
+            if mergeEncoder and scheduler.hasMergedFrames() and lastFrameBuffer is not None:
+                mergeEncoder.setPreviousFrame(*bitmapCommandToBitArray(lastFrameBuffer))
+                patches = mergeEncoder.encode(*bitmapCommandToBitArray(frameBuffer))
+                if sum(len(patch) for patch in patches) < len(frameBuffer):
+                    commands = patches
+            for command in commands:
+                self.writeBitmapCommand(command)
+            scheduler.frameSent(sum(len(command) for command in commands))
+            lastFrameBuffer = frameBuffer
+        return statistics
+
+    # (frame, isLastFrame) for each frame
+    def _withLastFlag(frames):
+        iterator = iter(frames)
+        frame = next(iterator, None)
+        while frame is not None:
+            nextFrame = next(iterator, None)
+            yield frame, nextFrame is None
+            frame = nextFrame
@@ -1,16 +1,65 @@
+import time
+
 # misc helpers
 def sanitizeUint8(value):
     return max(0,int(value)) & 0xFF
 
-# decorator to switch temporarly to high speed. IT REQUIRES self._panel!
+# decorator to run in a high speed session (see PyMOPanel.highSpeed). IT REQUIRES self._panel!
 def useHighSpeedDecorator(func):
     def wrapperFunction(*args, **kwargs):
         self = args[0]
-        previousBaudRate = self._panel.getBaudRate()
-        if previousBaudRate != 115200:
-            self._panel.setBaudRate(115200)
-        retValue = func(*args, **kwargs)
-        if previousBaudRate != 115200:
-            self._panel.setBaudRate(previousBaudRate)
-        return retValue
+        with self._panel.highSpeed():
+            return func(*args, **kwargs)
     return wrapperFunction
+
+# progress and throughput of a file transfer. It evaluates to True if the transfer succeeded
+class TransferStatistics:
+    def __init__(self, totalBytes, progressCallback = None):
+        self._totalBytes = totalBytes
+        self._transferredBytes = 0
+        self._progressCallback = progressCallback
+        self._startTimestamp = time.time()
+        self._endTimestamp = None
+        self._succeeded = False
+        self._retries = 0
+
+    # progressCallback(transferredBytes, totalBytes) is called on each update
+    def update(self, transferredBytes):
+        self._transferredBytes = transferredBytes
+        if self._progressCallback:
+            self._progressCallback(transferredBytes, self._totalBytes)
+
+    def addRetry(self):
+        self._retries += 1
+
+    def finish(self, succeeded):
+        self._endTimestamp = time.time()
+        self._succeeded = bool(succeeded)
+        return self
+
+    def getTransferredBytes(self):
+        return self._transferredBytes
+
+    def getTotalBytes(self):
+        return self._totalBytes
+
+    def getRetries(self):
+        return self._retries
+
+    def getElapsedTime(self):
+        return (self._endTimestamp if self._endTimestamp else time.time()) - self._startTimestamp
+
+    def getBytesPerSecond(self):
+        elapsedTime = self.getElapsedTime()
+        return self._transferredBytes / elapsedTime if elapsedTime > 0 else 0.
+
+    def __bool__(self):
+        return self._succeeded
+
+    def __repr__(self):
+        return "{} {}/{} bytes in {:.2f} s ({:.1f} bytes/s, {} retries)".format("succeeded" if self._succeeded else "failed",
+                                                                               self._transferredBytes,
+                                                                               self._totalBytes,
+                                                                               self.getElapsedTime(),
+                                                                               self.getBytesPerSecond(),
+                                                                               self._retries)
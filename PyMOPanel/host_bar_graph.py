@@ -0,0 +1,111 @@
+import itertools
+import numpy as np
+from .bar_graph import BarGraph, Direction
+from .delta_encoder import DeltaEncoder
+from .graphics import Graphics
+
+# bar graphs drawn by the host, without the firmware limit of BarGraphManager.MAX_NUMBER_OF_BARS, and removable.
+# The bars are rendered in a 1 bit copy of the screen, and each update only sends the pixels between the old and
+# the new value of the bars, as solid rectangles.
+# With exclusiveArea the bars own the area around them (nothing else is drawn between them), so the changes of
+# several bars can also be sent as bitmap patches of the changed area, when that is cheaper than one rectangle per bar
+class HostBarGraphManager:
+    # bytes of a 0xfe 0x78 color x0 y0 x1 y1 command
+    RECTANGLE_COMMAND_SIZE = 7
+
+    def __init__(self, panel, exclusiveArea = False):
+        self._panel = panel
+        self._exclusiveArea = exclusiveArea
+        self._barGraphs = {}
+        self._valuesInPixels = {}
+        self._nextIndex = itertools.count()
+        self._frameBuffer = np.zeros((Graphics.PANEL_HEIGHT, Graphics.PANEL_WIDTH), dtype=np.uint8)
+        self._deltaEncoder = DeltaEncoder()
+        self._bytesSent = 0
+        self._updatesCount = 0
+
+    # add bar graph, initially empty (its area is cleared). Returns its index
+    def addBarGraph(self, x0, y0, width, height, direction):
+        index = next(self._nextIndex)
+        self._barGraphs[index] = BarGraph(x0, y0, x0+width, y0+height, direction)
+        self._valuesInPixels[index] = 0
+        self._sendRegions([(x0, y0, x0+width, y0+height, 0)], None)
+        return index
+
+    # remove bar graph, clearing its area
+    def removeBarGraph(self, index):
+        barGraph = self._barGraphs.pop(index)
+        del self._valuesInPixels[index]
+        self._sendRegions([(barGraph._x0, barGraph._y0, barGraph._x1, barGraph._y1, 0)], None)
+
+    def getBarGraphsCount(self):
+        return len(self._barGraphs)
+
+    def setBarGraphValue(self, index, value):
+        self.setBarGraphValues({index: value})
+
+    # set the value of several bars ({index: value}), sending the changes in a single write
+    def setBarGraphValues(self, values):
+        previousFrameBuffer = self._frameBuffer.copy() if self._exclusiveArea and len(values) > 1 else None
+        regions = []
+        for index, value in values.items():
+            barGraph = self._barGraphs[index]
+            barGraph.setValue(value)
+            oldValue = self._valuesInPixels[index]
+            newValue = min(max(barGraph.getValueInPixels(), 0), barGraph._delta)
+            if newValue == oldValue:
+                continue
+            self._valuesInPixels[index] = newValue
+            self._updatesCount += 1
+            regions.append(HostBarGraphManager._getChangedRegion(barGraph, min(oldValue, newValue), max(oldValue, newValue)) + (1 if newValue > oldValue else 0,))
+        self._sendRegions(regions, previousFrameBuffer)
+
+    def getBytesSent(self):
+        return self._bytesSent
+
+    # number of bar value changes sent
+    def getUpdatesCount(self):
+        return self._updatesCount
+
+    def getBytesPerUpdate(self):
+        return self._bytesSent / self._updatesCount if self._updatesCount else 0.
+
+    # (x0, y0, x1, y1) area, with x1 and y1 exclusive, filled when the value in pixels goes from low to high
+    def _getChangedRegion(barGraph, low, high):
+        x0, y0, x1, y1 = barGraph._x0, barGraph._y0, barGraph._x1, barGraph._y1
+        direction = barGraph._direction
+        if direction == Direction.HORIZONTAL_LEFT_TO_RIGHT:
+            return x0 + low, y0, x0 + high, y1
+        if direction == Direction.HORIZONTAL_RIGHT_TO_LEFT:
+            return x1 - high, y0, x1 - low, y1
+        if direction == Direction.VERTICAL_TOP_TO_BOTTOM:
+            return x0, y0 + low, x1, y0 + high
+        return x0, y1 - high, x1, y1 - low
+
+    # draw the (x0, y0, x1, y1, value) regions in the frame buffer and send them
+    def _sendRegions(self, regions, previousFrameBuffer):
+        clippedRegions = []
+        for x0, y0, x1, y1, value in regions:
+            x0, x1 = max(x0, 0), min(x1, Graphics.PANEL_WIDTH)
+            y0, y1 = max(y0, 0), min(y1, Graphics.PANEL_HEIGHT)
+            if x0 < x1 and y0 < y1:
+                self._frameBuffer[y0:y1, x0:x1] = value
+                clippedRegions.append((x0, y0, x1, y1, value))
+        if not clippedRegions:
+            return
+        rectanglesSize = len(clippedRegions) * HostBarGraphManager.RECTANGLE_COMMAND_SIZE
+        if previousFrameBuffer is not None and len(clippedRegions) > 1:
+            x0 = min(region[0] for region in clippedRegions)
+            y0 = min(region[1] for region in clippedRegions)
+            x1 = max(region[2] for region in clippedRegions)
+            y1 = max(region[3] for region in clippedRegions)
+            self._deltaEncoder.setPreviousFrame(previousFrameBuffer[y0:y1, x0:x1], x0, y0)
+            patches = b''.join(self._deltaEncoder.encode(self._frameBuffer[y0:y1, x0:x1], x0, y0))
+            if len(patches) < rectanglesSize:
+                self._panel.writeBytes(patches)
+                self._bytesSent += len(patches)
+                return
+        with self._panel.batch():
+            for x0, y0, x1, y1, value in clippedRegions:
+                self._panel.graphics.drawRectangle(255 if value else 0, x0, y0, x1 - 1, y1 - 1, solid=True)
+        self._bytesSent += rectanglesSize
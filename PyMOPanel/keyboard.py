@@ -70,22 +70,33 @@ class KeyboardManager:
             # enable serial listener
             self.ThreadSerialListener._customCallbackForDataReceived = self.ThreadSerialListener.brightnessAndContrastControlCallback
             self.ThreadSerialListener._saveIgnoredKeys = True
-            self._threadedSerialListener = serial.threaded.ReaderThread(self._serialHandler, self.ThreadSerialListener)
-            self._threadedSerialListener.start()
+            if self._panel.isReceiverRunning():
+                # the panel receiver already reads the port, so get the keys from it
+                self._panel.setUnsolicitedCallback(self.ThreadSerialListener().data_received)
+            else:
+                self._threadedSerialListener = serial.threaded.ReaderThread(self._serialHandler, self.ThreadSerialListener)
+                self._threadedSerialListener.start()
             self.setAutoTransmitKeyPressed(True)
         else:
             # disable serial listener
-            self._threadedSerialListener.stop()
+            if self._threadedSerialListener:
+                self._threadedSerialListener.stop()
+                self._threadedSerialListener = None
+            self._panel.setUnsolicitedCallback(None)
             self.ThreadSerialListener._customCallbackForDataReceived = None
 
     # keypad methods
     def setAutoTransmitKeyPressed(self, state):
         self._autoTrasmitKeyPressed = bool(state)
+        if not self._panel.shadowState.update('autoTransmitKeyPressed', self._autoTrasmitKeyPressed):
+            return
         keyword = 0x41 if state else 0x4f
         self._panel.writeBytes([0xfe, keyword])
 
     def setAutoRepeatKeyMode(self, mode):
         self._autoRepeatKeyMode = mode
+        if not self._panel.shadowState.update('autoRepeatKeyMode', mode):
+            return
         if mode == AutoRepeatKeyMode.OFF:
             command_list = [0xfe, 0x60]
         else:
@@ -101,4 +112,6 @@ class KeyboardManager:
 
     def setDebounceTime(self, time):
         self._debounceTime = sanitizeUint8(time)
+        if not self._panel.shadowState.update('debounceTime', self._debounceTime):
+            return
         self._panel.writeBytes([0xfe, 0x55, self._debounceTime])
@@ -0,0 +1,258 @@
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from queue import Queue, Empty
+from threading import Thread, Lock
+
+# response parsers: they receive the pending input bytes and return the total number of bytes needed while the
+# response is incomplete, or a (consumedBytesCount, result) tuple
+def fixedLengthParser(length, convert = bytes):
+    def parse(buffer):
+        if len(buffer) < length:
+            return length
+        return length, convert(bytes(buffer[:length]))
+    return parse
+
+# responses starting with a little endian count of prefixLength bytes, followed by count items of itemSize bytes
+def lengthPrefixedParser(prefixLength, itemSize = 1, convert = bytes):
+    def parse(buffer):
+        if len(buffer) < prefixLength:
+            return prefixLength
+        responseLength = prefixLength + itemSize * int.from_bytes(buffer[:prefixLength], byteorder='little', signed=False)
+        if len(buffer) < responseLength:
+            return responseLength
+        return responseLength, convert(bytes(buffer[:responseLength]))
+    return parse
+
+# single reader of the serial port. Incoming bytes complete the outstanding requests in order, and any byte
+# received while no request is outstanding is unsolicited input (key presses), which is sent to the unsolicited
+# callback if set, or queued to be read with readUnsolicited(). A request fails with TimeoutError when no byte
+# is received for responseTimeout seconds while it is outstanding
+class ReceiveDemultiplexer:
+    def __init__(self, serialHandler, responseTimeout = 1.):
+        self._serialHandler = serialHandler
+        self._responseTimeout = responseTimeout
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._lock = Lock()
+        self._requestLock = Lock()
+        self._unsolicitedQueue = Queue()
+        self._unsolicitedCallback = None
+        self._lastActivityTimestamp = time.time()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread:
+            return
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._running = False
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            while self._pending:
+                self._pending.popleft()[0].set_exception(ConnectionAbortedError("receiver stopped"))
+
+    def isRunning(self):
+        return self._thread is not None
+
+    # register a response parser and send the command with writeFunction. Returns a Future with the parsed response
+    def request(self, command, parser, writeFunction):
+        future = Future()
+        # the lock keeps the order of the outstanding requests equal to the order of the commands
+        with self._requestLock:
+            with self._lock:
+                if not self._pending:
+                    self._lastActivityTimestamp = time.time()
+                self._pending.append((future, parser))
+            writeFunction(command)
+        return future
+
+    def setUnsolicitedCallback(self, callback):
+        self._unsolicitedCallback = callback
+
+    # read up to count unsolicited bytes, waiting up to timeout seconds for each one
+    def readUnsolicited(self, count, timeout = None):
+        output = bytearray()
+        try:
+            while len(output) < count:
+                output += self._unsolicitedQueue.get(timeout=timeout)
+        except Empty:
+            pass
+        return bytes(output)
+
+    def clearUnsolicited(self):
+        while not self._unsolicitedQueue.empty():
+            self._unsolicitedQueue.get_nowait()
+
+    def _run(self):
+        while self._running:
+            try:
+                data = self._serialHandler.read(self._serialHandler.in_waiting or 1)
+            except Exception:
+                traceback.print_exc()
+                break
+            completed, unsolicited = self._process(data)
+            for future, result in completed:
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            if unsolicited:
+                self._dispatchUnsolicited(unsolicited)
+        self._running = False
+
+    # returns the (future, result or exception) of the completed requests, and the unsolicited bytes
+    def _process(self, data):
+        completed = []
+        now = time.time()
+        with self._lock:
+            if data:
+                self._lastActivityTimestamp = now
+                self._buffer += data
+            elif self._pending and now - self._lastActivityTimestamp > self._responseTimeout:
+                future, _ = self._pending.popleft()
+                completed.append((future, TimeoutError("no response from the panel ({} bytes received)".format(len(self._buffer)))))
+                self._buffer.clear()
+                self._lastActivityTimestamp = now
+            while self._pending and self._buffer:
+                future, parser = self._pending[0]
+                try:
+                    parsed = parser(self._buffer)
+                except Exception as exception:
+                    parsed = (len(self._buffer), exception)
+                if not isinstance(parsed, tuple):
+                    break
+                consumedBytesCount, result = parsed
+                del self._buffer[:consumedBytesCount]
+                self._pending.popleft()
+                completed.append((future, result))
+            if self._pending or not self._buffer:
+                return completed, None
+            unsolicited = bytes(self._buffer)
+            self._buffer.clear()
+            return completed, unsolicited
+
+    def _dispatchUnsolicited(self, data):
+        if self._unsolicitedCallback:
+            try:
+                self._unsolicitedCallback(data)
+            except Exception:
+                traceback.print_exc()
+            return
+        for byte in data:
+            self._unsolicitedQueue.put(bytes([byte]))
+
+class ShortReadError(Exception):
+    pass
+
+# response made of a little endian length of prefixLength bytes followed by that many bytes, read as a stream of
+# chunks. With the receiver running it is used as the parser of the request and gets the bytes from its thread,
+# otherwise the bytes are read with readFunction when the consumer iterates. Closing the iteration before the end
+# discards the rest of the response
+class ResponseStream:
+    def __init__(self, prefixLength = 4, chunkSize = 256, timeout = 1.):
+        self._prefixLength = prefixLength
+        self._chunkSize = chunkSize
+        self._timeout = timeout
+        self._size = None
+        self._receivedBytes = 0
+        self._chunks = Queue()
+        self._discard = False
+        self._readFunction = None
+        self._future = None
+        self._readBuffer = bytearray()
+
+    # parser interface: consumes all the available bytes of the response
+    def __call__(self, buffer):
+        if self._size is None:
+            if len(buffer) < self._prefixLength:
+                return self._prefixLength
+            self._size = int.from_bytes(buffer[:self._prefixLength], byteorder='little', signed=False)
+            del buffer[:self._prefixLength]
+            self._chunks.put(None)
+        newBytesCount = min(len(buffer), self._size - self._receivedBytes)
+        if newBytesCount:
+            if not self._discard:
+                self._chunks.put(bytes(buffer[:newBytesCount]))
+            del buffer[:newBytesCount]
+            self._receivedBytes += newBytesCount
+        if self._receivedBytes == self._size:
+            return 0, None
+        return min(self._chunkSize, self._size - self._receivedBytes)
+
+    def setReadFunction(self, readFunction):
+        self._readFunction = readFunction
+
+    def setFuture(self, future):
+        self._future = future
+
+    # size of the response payload (it waits for the length prefix)
+    def getSize(self):
+        if self._size is None:
+            # the size is signaled with a None in the chunks queue
+            self._nextItem()
+        return self._size
+
+    def getReceivedBytes(self):
+        return self._receivedBytes
+
+    # generator of chunks of chunkSize bytes (the last one may be shorter). Raises ShortReadError if the panel
+    # stops sending before the announced size
+    def chunks(self):
+        size = self.getSize()
+        outputChunk = bytearray()
+        consumedBytes = 0
+        try:
+            while consumedBytes < size:
+                data = self._nextItem()
+                outputChunk += data
+                while len(outputChunk) >= self._chunkSize or (outputChunk and consumedBytes + len(outputChunk) == size):
+                    chunk = bytes(outputChunk[:self._chunkSize])
+                    del outputChunk[:self._chunkSize]
+                    consumedBytes += len(chunk)
+                    yield chunk
+        finally:
+            if consumedBytes < size:
+                self.close()
+
+    # discard the rest of the response
+    def close(self):
+        self._discard = True
+        while not self._chunks.empty():
+            self._chunks.get_nowait()
+        if self._readFunction:
+            try:
+                while self._size is None or self._receivedBytes < self._size:
+                    self._pump()
+            except ShortReadError:
+                pass
+
+    def _pump(self):
+        needed = self(self._readBuffer)
+        if isinstance(needed, tuple):
+            return
+        data = self._readFunction(needed - len(self._readBuffer))
+        if not data:
+            raise ShortReadError("response ended after {} of {} bytes".format(self._receivedBytes, self._size))
+        self._readBuffer += data
+        self(self._readBuffer)
+
+    def _nextItem(self):
+        while True:
+            if self._chunks.empty() and self._readFunction:
+                self._pump()
+                continue
+            try:
+                return self._chunks.get(timeout=self._timeout)
+            except Empty:
+                if self._future and self._future.done() and self._chunks.empty():
+                    if self._future.exception():
+                        raise ShortReadError("response ended after {} of {} bytes".format(self._receivedBytes, self._size))
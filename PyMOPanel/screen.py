@@ -1,5 +1,7 @@
 from time import sleep
 from .helpers import sanitizeUint8
+from .serial_writer import Lane
+from .bar_graph import BarGraphManager
 
 class Screen:
     def __init__(self, panel, initBrightness = 200, initContrast = 128):
@@ -11,8 +13,12 @@ class Screen:
         self.setContrast(initContrast)
         self.enable(True)
 
+    # the bar graphs drawn by the panel are cleared too, so their values are sent again on the next update
     def clear(self):
-        self._panel.writeBytes([0xfe, 0x58])
+        with self._panel.shadowState.getWriteLock():
+            self._panel.writeBytes([0xfe, 0x58])
+            for index in range(BarGraphManager.MAX_NUMBER_OF_BARS):
+                self._panel.shadowState.invalidate(('barGraph', index))
 
     def enable(self, value, minsToEnable = 0):
         value = bool(value)
@@ -24,22 +30,22 @@ class Screen:
 
     def setBrightness(self, brightness, persistent = False):
         sanitizedValue = sanitizeUint8(brightness)
-        if sanitizedValue == self._brightness:
-            return
         self._brightness = sanitizedValue
+        if not self._panel.shadowState.update('brightness', sanitizedValue):
+            return
         self._panel.writeBytes([0xfe, 0x98 if persistent else 0x99, 
-                         sanitizedValue])
+                         sanitizedValue], Lane.INTERACTIVE)
 
     def incBrightness(self, increment):
         self.setBrightness(self._brightness + increment)
 
     def setContrast(self, contrast, persistent = False):
         sanitizedValue = sanitizeUint8(contrast)
-        if sanitizedValue == self._contrast:
-            return
         self._contrast = sanitizedValue
+        if not self._panel.shadowState.update('contrast', sanitizedValue):
+            return
         self._panel.writeBytes([0xfe, 0x91 if persistent else 0x50,
-                         sanitizedValue])
+                         sanitizedValue], Lane.INTERACTIVE)
 
     def incContrast(self, increment):
         self.setContrast(self._contrast + increment)
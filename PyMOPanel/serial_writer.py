@@ -0,0 +1,94 @@
+import itertools
+import time
+from enum import Enum
+from queue import PriorityQueue
+from threading import Thread, Lock
+
+# priority lanes of the serial writer thread. Lower values are sent first, so commands that draw on the screen must
+# stay in the NORMAL lane: sent before a pending clear of the screen, they would be erased by it. INTERACTIVE is for
+# commands that do not change the screen contents (GPO, brightness, contrast)
+class Lane(Enum):
+    INTERACTIVE = 0
+    NORMAL      = 1
+    BULK        = 2
+
+# latency (from enqueueing to the end of the write) of the commands sent through one lane
+class LaneStatistics:
+    def __init__(self):
+        self._count = 0
+        self._totalLatency = 0.
+        self._maxLatency = 0.
+        self._lock = Lock()
+
+    def addLatency(self, latency):
+        with self._lock:
+            self._count += 1
+            self._totalLatency += latency
+            self._maxLatency = max(self._maxLatency, latency)
+
+    def reset(self):
+        with self._lock:
+            self._count = 0
+            self._totalLatency = 0.
+            self._maxLatency = 0.
+
+    def getCount(self):
+        return self._count
+
+    def getMeanLatency(self):
+        return self._totalLatency / self._count if self._count else 0.
+
+    def getMaxLatency(self):
+        return self._maxLatency
+
+    def __repr__(self):
+        return "{} writes, mean {:.1f} ms, max {:.1f} ms".format(self._count, 1000 * self.getMeanLatency(), 1000 * self.getMaxLatency())
+
+# thread writing queued buffers to the serial port, highest priority lane first and FIFO within a lane.
+# Buffers are never split, so each one must end at a command boundary
+class SerialWriter:
+    def __init__(self, writeFunction):
+        self._writeFunction = writeFunction
+        self._queue = PriorityQueue()
+        self._sequence = itertools.count()
+        self._statistics = {lane: LaneStatistics() for lane in Lane}
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # stop the thread after sending all the queued buffers
+    def stop(self):
+        if not self._thread:
+            return
+        self._queue.put((len(Lane), next(self._sequence), None, None))
+        self._thread.join()
+        self._thread = None
+
+    def isRunning(self):
+        return self._thread is not None
+
+    def put(self, buffer, lane = Lane.NORMAL):
+        self._queue.put((lane.value, next(self._sequence), time.perf_counter(), bytes(buffer)))
+
+    # block until all the queued buffers were written
+    def waitUntilEmpty(self):
+        self._queue.join()
+
+    def getLaneStatistics(self):
+        return dict(self._statistics)
+
+    def _run(self):
+        while True:
+            laneValue, _, enqueueTimestamp, buffer = self._queue.get()
+            if buffer is None:
+                self._queue.task_done()
+                return
+            try:
+                self._writeFunction(buffer, Lane(laneValue))
+                self._statistics[Lane(laneValue)].addLatency(time.perf_counter() - enqueueTimestamp)
+            finally:
+                self._queue.task_done()
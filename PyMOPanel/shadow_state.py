@@ -0,0 +1,35 @@
+from threading import Lock, RLock
+
+# last value sent to the panel for each setting, so subsystems can skip commands that would not change anything.
+# Call invalidate() when the panel may have lost its state (e.g. after a reset), so every setting is sent again
+class ShadowState:
+    def __init__(self):
+        self._values = {}
+        self._lock = Lock()
+        self._writeLock = RLock()
+
+    # lock to hold while updating values and writing their commands (or writing a command that resets values and
+    # invalidating them), so the values are marked as sent in the same order as their commands are written. E.g. a
+    # bar value updated from another thread is not marked as drawn and then written before a clear of the screen
+    def getWriteLock(self):
+        return self._writeLock
+
+    # store the value and return True if it differs from the last one sent (i.e. the command has to be sent)
+    def update(self, key, value):
+        with self._lock:
+            if key in self._values and self._values[key] == value:
+                return False
+            self._values[key] = value
+            return True
+
+    def get(self, key, default = None):
+        with self._lock:
+            return self._values.get(key, default)
+
+    # forget one setting, or all of them if no key is given
+    def invalidate(self, key = None):
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
@@ -0,0 +1,123 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from .filesystem import FileType, Filesystem
+from .bitmap import bitArrayToBitmapCommand, bitmapCommandToBitArray
+
+# keeps frequently shown bitmaps in the panel flash as FileType.BITMAP files, so showing them again costs a
+# 0xfe 0x62 command (5 bytes) instead of the whole bitmap. Only the bitmap ids that were free when the cache was
+# created are used, and when the flash is full the least recently shown sprites are removed
+class SpriteCache:
+    # bitmaps are uploaded after being shown this number of times
+    DEFAULT_UPLOAD_THRESHOLD = 2
+    # maximum number of not yet uploaded bitmaps whose hits are counted
+    MAX_TRACKED_CANDIDATES = 1024
+
+    def __init__(self, panel, uploadThreshold = DEFAULT_UPLOAD_THRESHOLD, reservedBytes = 0):
+        self._panel = panel
+        self._uploadThreshold = uploadThreshold
+        self._reservedBytes = reservedBytes
+        self._lock = Lock()
+        self._sprites = OrderedDict()       # key -> (fileId, fileSize)
+        self._candidates = OrderedDict()    # key -> hits
+        usedBitmapIds = set(panel.fs.getBitmapIds())
+        self._freeIds = [fileId for fileId in range(1, Filesystem.MAX_FILE_ID + 1) if fileId not in usedBitmapIds]
+        self._freeBytes = panel.fs.free()
+
+    def getSpritesCount(self):
+        return len(self._sprites)
+
+    def getFreeBytes(self):
+        return self._freeBytes
+
+    def _makeKey(bits):
+        return hashlib.sha1(bytes(bits.shape) + bits.tobytes()).hexdigest()
+
+    # show a (height, width) array of 1 bit pixels at x0,y0. Returns the number of bytes sent to show it
+    # (not counting the upload of new sprites). Without upload, its hits are not counted and it is only shown as a
+    # sprite if it was already uploaded (e.g. by preloadBitmapCommands)
+    def show(self, bits, x0=0, y0=0, upload=True):
+        key = SpriteCache._makeKey(bits)
+        with self._lock:
+            if upload and key not in self._sprites and self._isFrequent(key):
+                self._uploadSprite(key, bits)
+            if key in self._sprites:
+                self._sprites.move_to_end(key)
+                self._panel.graphics.showBitmap(self._sprites[key][0], x0, y0)
+                return 5
+        command = bitArrayToBitmapCommand(bits, x0, y0)
+        self._panel.graphics.writeBitmapCommand(command)
+        return len(command)
+
+    # same as show(), for a 0xfe 0x64 command such as the ones in the FrameCache
+    def showBitmapCommand(self, command, upload=True):
+        return self.show(*bitmapCommandToBitArray(command), upload)
+
+    # count in advance the hits of the frames (0xfe 0x64 commands) that a playback will show, uploading the ones
+    # that become frequent, so the playback can show them with upload=False and no upload delays its frames.
+    # It stops uploading when a sprite of these frames would be evicted. Returns the number of bytes uploaded
+    def preloadBitmapCommands(self, commands):
+        uploadedBytes = 0
+        preloadedKeys = []
+        with self._lock:
+            for command in commands:
+                bits = bitmapCommandToBitArray(command)[0]
+                key = SpriteCache._makeKey(bits)
+                if key in self._sprites:
+                    self._sprites.move_to_end(key)
+                    preloadedKeys.append(key)
+                    continue
+                if not self._isFrequent(key):
+                    continue
+                self._uploadSprite(key, bits)
+                if not all(preloadedKey in self._sprites for preloadedKey in preloadedKeys):
+                    break
+                if key in self._sprites:
+                    uploadedBytes += self._sprites[key][1]
+                    preloadedKeys.append(key)
+        return uploadedBytes
+
+    # remove all the sprites uploaded by this cache from the panel
+    def clear(self):
+        with self._lock:
+            while self._sprites:
+                self._evictOldestSprite()
+            self._candidates.clear()
+            self._freeBytes = self._panel.fs.free()
+
+    def _isFrequent(self, key):
+        hits = self._candidates.pop(key, 0) + 1
+        if hits >= self._uploadThreshold:
+            return True
+        self._candidates[key] = hits
+        if len(self._candidates) > SpriteCache.MAX_TRACKED_CANDIDATES:
+            self._candidates.popitem(last=False)
+        return False
+
+    def _evictOldestSprite(self):
+        _, (fileId, fileSize) = self._sprites.popitem(last=False)
+        self._panel.fs.rm(FileType.BITMAP, fileId)
+        self._freeIds.append(fileId)
+        self._freeBytes += fileSize
+
+    def _uploadSprite(self, key, bits):
+        height, width = bits.shape
+        fileSize = 2 + (width * height + 7) // 8
+        if fileSize + self._reservedBytes > Filesystem.FILESYSTEM_SIZE:
+            return
+        evicted = False
+        while self._sprites and (not self._freeIds or self._freeBytes - self._reservedBytes < fileSize):
+            self._evictOldestSprite()
+            evicted = True
+        if evicted:
+            # resync with the panel, since the filesystem may use more space than the files size
+            self._freeBytes = self._panel.fs.free()
+        if not self._freeIds or self._freeBytes - self._reservedBytes < fileSize:
+            return
+        fileId = self._freeIds.pop(0)
+        if not self._panel.fs.uploadBitmap(bits, fileId):
+            print("error uploading sprite {}".format(fileId))
+            self._freeIds.append(fileId)
+            return
+        self._sprites[key] = (fileId, fileSize)
+        self._freeBytes = self._panel.fs.free()
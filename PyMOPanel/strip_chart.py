@@ -0,0 +1,155 @@
+import numpy as np
+from .bitmap import bitArrayToBitmapCommand, bitmapCommandSize
+from .delta_encoder import DeltaEncoder
+
+# strip chart of the samples in the (width, height) area at x0,y0. Samples are decimated to one pixel column
+# every samplesPerColumn samples, keeping the min and max of each column in a ring buffer, so any sample rate can
+# be graphed. refresh() sends the new columns since the last refresh:
+# - scroll mode: the chart moves to the left. The shifted columns are sent as patches of what changed, and the new
+#   columns at the right are drawn with a clear rectangle and a vertical line each
+# - sweep mode: the chart is not moved. The new columns overwrite the oldest ones from left to right, clearing the
+#   column after them as a gap, which costs only the new columns
+class StripChart:
+    # bytes of the clear rectangle plus the line of a column
+    COLUMN_COMMANDS_SIZE = 7 + 6
+
+    def __init__(self, panel, x0, y0, width, height, minValue = 0., maxValue = 1., samplesPerColumn = 1, scroll = True):
+        self._panel = panel
+        self._x0 = x0
+        self._y0 = y0
+        self._width = width
+        self._height = height
+        self._minValue = minValue
+        self._maxValue = maxValue
+        self._samplesPerColumn = samplesPerColumn
+        self._scroll = scroll
+        # ring buffer of the min and max sample of the last width columns
+        self._columnsMin = np.zeros(width)
+        self._columnsMax = np.zeros(width)
+        self._columnsCount = 0
+        # samples of the column in progress
+        self._pendingMin = np.inf
+        self._pendingMax = -np.inf
+        self._pendingCount = 0
+        # columns added since the last refresh
+        self._newColumnsCount = 0
+        # chart area as shown in the panel
+        self._screenBits = np.zeros((height, width), dtype=np.uint8)
+        self._deltaEncoder = DeltaEncoder()
+        self._bytesSent = 0
+
+    def getBytesSent(self):
+        return self._bytesSent
+
+    def getColumnsCount(self):
+        return self._columnsCount
+
+    def addSample(self, value):
+        self.addSamples([value])
+
+    def addSamples(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        # complete the column in progress
+        missingCount = self._samplesPerColumn - self._pendingCount
+        head, values = values[:missingCount], values[missingCount:]
+        if len(head):
+            self._pendingMin = min(self._pendingMin, head.min())
+            self._pendingMax = max(self._pendingMax, head.max())
+            self._pendingCount += len(head)
+        if self._pendingCount < self._samplesPerColumn:
+            return
+        completeCount = len(values) // self._samplesPerColumn
+        columns = values[:completeCount * self._samplesPerColumn].reshape(completeCount, self._samplesPerColumn)
+        self._appendColumns(np.concatenate(([self._pendingMin], columns.min(axis=1))),
+                            np.concatenate(([self._pendingMax], columns.max(axis=1))))
+        rest = values[completeCount * self._samplesPerColumn:]
+        self._pendingMin = rest.min() if len(rest) else np.inf
+        self._pendingMax = rest.max() if len(rest) else -np.inf
+        self._pendingCount = len(rest)
+
+    def _appendColumns(self, columnsMin, columnsMax):
+        columnsMin, columnsMax = columnsMin[-self._width:], columnsMax[-self._width:]
+        indexes = (self._columnsCount + np.arange(len(columnsMin))) % self._width
+        self._columnsMin[indexes] = columnsMin
+        self._columnsMax[indexes] = columnsMax
+        self._columnsCount += len(columnsMin)
+        self._newColumnsCount = min(self._newColumnsCount + len(columnsMin), self._width)
+
+    def _toRows(self, values):
+        scaled = (values - self._minValue) / (self._maxValue - self._minValue)
+        return (self._height - 1) - np.clip(np.rint(scaled * (self._height - 1)), 0, self._height - 1).astype(np.int64)
+
+    # (top, bottom) rows of the last count columns, oldest first. Each column is extended to reach the previous
+    # one, so the trace is continuous
+    def _getColumnSpans(self, count):
+        count = min(count, self._columnsCount)
+        # one more column to connect the first one
+        withPrevious = min(count + 1, self._columnsCount)
+        indexes = (self._columnsCount - withPrevious + np.arange(withPrevious)) % self._width
+        top = self._toRows(self._columnsMax[indexes])
+        bottom = self._toRows(self._columnsMin[indexes])
+        connectedTop, connectedBottom = top.copy(), bottom.copy()
+        connectedTop[1:] = np.minimum(top[1:], bottom[:-1])
+        connectedBottom[1:] = np.maximum(bottom[1:], top[:-1])
+        return connectedTop[withPrevious - count:], connectedBottom[withPrevious - count:]
+
+    def _renderColumns(self, top, bottom):
+        rows = np.arange(self._height)[:, np.newaxis]
+        return ((rows >= top) & (rows <= bottom)).astype(np.uint8)
+
+    # send the columns added since the last refresh, in a single write. Returns the number of bytes sent
+    def refresh(self):
+        newCount = self._newColumnsCount
+        if newCount == 0:
+            return 0
+        self._newColumnsCount = 0
+        top, bottom = self._getColumnSpans(newCount)
+        newBits = self._renderColumns(top, bottom)
+        if self._scroll:
+            targetBits = np.zeros_like(self._screenBits)
+            shownCount = min(self._columnsCount, self._width)
+            targetBits[:, self._width - shownCount:self._width - newCount] = self._screenBits[:, self._width - shownCount + newCount:]
+            targetBits[:, self._width - newCount:] = newBits
+            newColumnsX = np.arange(self._width - newCount, self._width)
+        else:
+            targetBits = self._screenBits.copy()
+            newColumnsX = (self._columnsCount - newCount + np.arange(newCount)) % self._width
+            targetBits[:, newColumnsX] = newBits
+            if self._hasGap(newColumnsX):
+                targetBits[:, newColumnsX[-1] + 1] = 0
+
+        with self._panel.batch():
+            bytesCount = self._sendChanges(targetBits, newColumnsX, top, bottom)
+        self._screenBits = targetBits
+        self._bytesSent += bytesCount
+        return bytesCount
+
+    # in sweep mode the column after the last new one is cleared, unless it is the last column of the area
+    def _hasGap(self, newColumnsX):
+        return not self._scroll and newColumnsX[-1] + 1 < self._width
+
+    def _sendChanges(self, targetBits, newColumnsX, top, bottom):
+        fullSize = bitmapCommandSize(self._width, self._height)
+        commands = []
+        if self._scroll:
+            shiftedWidth = self._width - len(newColumnsX)
+            if shiftedWidth:
+                self._deltaEncoder.setPreviousFrame(self._screenBits[:, :shiftedWidth], self._x0, self._y0)
+                commands = self._deltaEncoder.encode(targetBits[:, :shiftedWidth], self._x0, self._y0)
+        shiftSize = sum(len(command) for command in commands)
+        clearWidths = np.ones(len(newColumnsX), dtype=np.int64)
+        if self._hasGap(newColumnsX):
+            clearWidths[-1] = 2
+        if shiftSize + len(newColumnsX) * self.COLUMN_COMMANDS_SIZE >= fullSize:
+            command = bitArrayToBitmapCommand(targetBits, self._x0, self._y0)
+            self._panel.writeBytes(command)
+            return len(command)
+
+        for command in commands:
+            self._panel.writeBytes(command)
+        graphics = self._panel.graphics
+        graphics.setDrawingColor(255)
+        for x, clearWidth, columnTop, columnBottom in zip(newColumnsX.tolist(), clearWidths.tolist(), top.tolist(), bottom.tolist()):
+            graphics.drawRectangle(0, self._x0 + x, self._y0, self._x0 + x + clearWidth - 1, self._y0 + self._height - 1, solid=True)
+            graphics.drawLine(self._x0 + x, self._y0 + columnTop, self._x0 + x, self._y0 + columnBottom)
+        return shiftSize + len(newColumnsX) * self.COLUMN_COMMANDS_SIZE
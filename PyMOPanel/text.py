@@ -1,4 +1,5 @@
 from .helpers import sanitizeUint8
+from .text_layout import TextLayout
 class Text:
     def __init__(self,
                  panel,
@@ -49,6 +50,12 @@ class Text:
         self._charSpacing = sanitizeUint8(charSpacing)
         self._lineSpacing = sanitizeUint8(lineSpacing)
         self._lastYRow    = sanitizeUint8(lastYRow)
+        if not self._panel.shadowState.update('fontMetrics', (self._leftMargin,
+                                                               self._topMargin,
+                                                               self._charSpacing,
+                                                               self._lineSpacing,
+                                                               self._lastYRow)):
+            return
         self._panel.writeBytes([0xfe, 0x32,
                                 self._leftMargin,
                                 self._topMargin,
@@ -70,12 +77,26 @@ class Text:
     def getlastYRow(self):
         return self._lastYRow
 
+    def getCurrentFont(self):
+        return self._currentFont
+
+    # TextLayout of the current font (or the given Font) with the current metrics, or None if the font is unknown
+    def getLayout(self, font = None):
+        font = font if font else self._panel.fonts.getCurrentFont()
+        if not font:
+            return None
+        return TextLayout.fromText(self, font)
+
     def setBoxSpaceMode(self, value):
         self._boxSpaceModeEnabled = value
+        if not self._panel.shadowState.update('boxSpaceMode', bool(value)):
+            return
         self._panel.writeBytes([0xfe, 0xac, 1 if value else 0])
 
     def selectCurrentFont(self, font_ref_id) :
         self._currentFont = sanitizeUint8(font_ref_id)
+        if not self._panel.shadowState.update('currentFont', self._currentFont):
+            return
         self._panel.writeBytes([0xfe, 0x31,
                                 self._currentFont])
 
@@ -94,5 +115,7 @@ class Text:
 
     def setAutoScroll(self, state):
         self._autoScroll = bool(state)
+        if not self._panel.shadowState.update('autoScroll', self._autoScroll):
+            return
         keyword = 0x51 if state else 0x52
         self._panel.writeBytes([0xfe, keyword])
@@ -0,0 +1,133 @@
+import numpy as np
+from .delta_encoder import findRuns
+
+# grid of text cells (1 based columns and rows, as in Text.setCursorMoveToPos) keeping what was last sent to
+# each cell. refresh() only sends the changed spans of each row, with a cursor move per span. Spans separated by
+# fewer unchanged chars than the cost of a cursor move are merged and sent as one.
+# With a TextLayout of a proportional font the chars are not aligned to cells, so a change is sent from its first
+# char up to the end of the row, positioned in pixels, after clearing the pixels of the previous text
+class TextGrid:
+    # bytes of a 0xfe 0x47 col row (or 0xfe 0x79 x y) command
+    CURSOR_MOVE_SIZE = 4
+    # bytes of a 0xfe 0x78 color x0 y0 x1 y1 command
+    RECTANGLE_COMMAND_SIZE = 7
+
+    def __init__(self, panel, cols = None, rows = None, layout = None, fontRefId = None):
+        self._panel = panel
+        self._layout = layout
+        self._fontRefId = fontRefId
+        if cols is None:
+            cols = layout.getColsCount()
+        if rows is None:
+            rows = layout.getRowsCount()
+        self._cells = np.full((rows, cols), ord(' '), dtype=np.uint8)
+        self._sentCells = np.zeros((rows, cols), dtype=np.uint8)
+        # cells whose content in the panel is unknown (and are sent on the next refresh)
+        self._unknown = np.ones((rows, cols), dtype=bool)
+        self._monospaced = layout is None or bool(np.all(layout.getFont().getCharWidths() == layout.getFont().getNominalWidth()))
+        self._bytesSent = 0
+
+    def getColsCount(self):
+        return self._cells.shape[1]
+
+    def getRowsCount(self):
+        return self._cells.shape[0]
+
+    def getBytesSent(self):
+        return self._bytesSent
+
+    # forget what is shown, e.g. after clearing the screen, so everything is sent again on the next refresh
+    def invalidate(self):
+        self._unknown[:] = True
+
+    # the screen was cleared, so all the cells are known to be blank
+    def markCleared(self):
+        self._sentCells[:] = ord(' ')
+        self._unknown[:] = False
+
+    # set the text of the cells from col,row. Text that does not fit in the row is truncated
+    def setText(self, text, col, row):
+        codes = np.frombuffer(bytes(text, 'latin-1', 'replace') if type(text) == str else bytes(text), dtype=np.uint8)
+        start = col - 1
+        codes = codes[:max(0, self.getColsCount() - start)]
+        self._cells[row - 1, start:start + len(codes)] = codes
+
+    def getText(self, row):
+        return self._cells[row - 1].tobytes().decode('latin-1')
+
+    # set the text and refresh
+    def print(self, text, col, row):
+        self.setText(text, col, row)
+        return self.refresh()
+
+    # send the changed spans in a single write. Returns the number of bytes sent
+    def refresh(self):
+        changed = (self._cells != self._sentCells) | self._unknown
+        changedRows = np.flatnonzero(changed.any(axis=1))
+        if len(changedRows) == 0:
+            return 0
+        bytesCount = 0
+        with self._panel.batch():
+            if self._fontRefId is not None:
+                self._panel.text.selectCurrentFont(self._fontRefId)
+            for row in changedRows.tolist():
+                for start, end in self._getSpans(row, changed[row]):
+                    bytesCount += self._sendSpan(row, start, end)
+        self._sentCells[:] = self._cells
+        self._unknown[:] = False
+        self._bytesSent += bytesCount
+        return bytesCount
+
+    def _getSpans(self, row, changedCells):
+        if self._monospaced:
+            return findRuns(changedCells, self.CURSOR_MOVE_SIZE)
+        # up to the last char that is or was not blank
+        notBlank = (self._cells[row] != ord(' ')) | (self._sentCells[row] != ord(' ')) | self._unknown[row]
+        return [(int(np.argmax(changedCells)), int(np.flatnonzero(notBlank)[-1]) + 1)]
+
+    def _sendSpan(self, row, start, end):
+        chars = self._cells[row, start:end].tobytes()
+        bytesCount = self.CURSOR_MOVE_SIZE + len(chars)
+        if self._monospaced:
+            self._panel.text.setCursorMoveToPos(start + 1, row + 1)
+        else:
+            x, y = self._layout.cellToPixel(1, row + 1)
+            x = int(self._layout.getCharPositions(self._cells[row, :start + 1].tobytes(), x)[start])
+            bytesCount += self._clearPreviousText(row, start, end, x, y)
+            self._panel.text.setCursorCoordinate(x, y)
+        self._panel.text.print(chars)
+        return bytesCount
+
+    # clear the pixels of the previous text of the span (up to the row end if unknown), as the new text may not cover
+    # them: it can be narrower, and the spacing between its chars is not drawn. Returns the number of bytes sent
+    def _clearPreviousText(self, row, start, end, x, y):
+        if self._unknown[row, start:end].any():
+            x1 = self._layout.getPanelWidth()
+        else:
+            previousChars = self._sentCells[row, start:end]
+            if np.all(previousChars == ord(' ')):
+                return 0
+            x1 = self._layout.getBoundingBox(previousChars.tobytes(), x, y)[2]
+        _, y0, _, y1 = self._layout.getBoundingBox(self._cells[row, start:end].tobytes(), x, y)
+        if x1 <= x:
+            return 0
+        self._panel.graphics.drawRectangle(0, x, y0, x1 - 1, y1 - 1, solid=True)
+        return self.RECTANGLE_COMMAND_SIZE
+
+# fixed width region of a TextGrid row, e.g. for a value that is updated often
+class TextField:
+    def __init__(self, grid, col, row, width, alignRight = False):
+        self._grid = grid
+        self._col = col
+        self._row = row
+        self._width = width
+        self._alignRight = alignRight
+
+    # set the text, padded with spaces or truncated to the field width. It is sent on the next grid refresh
+    def setText(self, text):
+        text = text[:self._width]
+        text = text.rjust(self._width) if self._alignRight else text.ljust(self._width)
+        self._grid.setText(text, self._col, self._row)
+
+    def getText(self):
+        return self._grid.getText(self._row)[self._col - 1:self._col - 1 + self._width]
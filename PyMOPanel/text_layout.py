@@ -0,0 +1,122 @@
+import numpy as np
+from .graphics import Graphics
+
+# host side measurement of the text printed by the panel with a Font and the Text metrics, so the exact pixels
+# covered by a text are known. Chars are placed from the cursor position, advancing their width plus charSpacing,
+# and wrap to the left margin of the next line when they do not fit in the panel width. Chars outside the font
+# ascii range are measured with the nominal width
+class TextLayout:
+    def __init__(self,
+                 font,
+                 leftMargin = 0,
+                 topMargin = 0,
+                 charSpacing = 1,
+                 lineSpacing = 1,
+                 lastYRow = Graphics.PANEL_HEIGHT,
+                 panelWidth = Graphics.PANEL_WIDTH):
+        self._font = font
+        self._leftMargin = leftMargin
+        self._topMargin = topMargin
+        self._charSpacing = charSpacing
+        self._lineSpacing = lineSpacing
+        self._lastYRow = lastYRow
+        self._panelWidth = panelWidth
+        # width of each of the 256 char codes
+        charWidths = font.getCharWidths()
+        asciiStart = font.getAsciiRange()[0]
+        self._widthsTable = np.full(256, font.getNominalWidth(), dtype=np.int64)
+        self._widthsTable[asciiStart:asciiStart + len(charWidths)] = charWidths
+
+    # layout with the metrics of a Text instance
+    def fromText(text, font):
+        return TextLayout(font,
+                          text.getLeftMargin(),
+                          text.getTopMargin(),
+                          text.getCharSpacing(),
+                          text.getLineSpacing(),
+                          text.getlastYRow())
+
+    def getFont(self):
+        return self._font
+
+    def getPanelWidth(self):
+        return self._panelWidth
+
+    def getLineHeight(self):
+        return self._font.getHeight() + self._lineSpacing
+
+    # number of cursor columns (of the nominal width) that fit in a line
+    def getColsCount(self):
+        return max(0, (self._panelWidth - self._leftMargin + self._charSpacing) // (self._font.getNominalWidth() + self._charSpacing))
+
+    # number of text rows that fit above the last y row
+    def getRowsCount(self):
+        return max(0, (self._lastYRow - self._topMargin + self._lineSpacing) // self.getLineHeight())
+
+    # top left pixel of a cursor position (as in Text.setCursorMoveToPos, 1 based. 0 is handled as 1)
+    def cellToPixel(self, col, row):
+        return (self._leftMargin + max(col - 1, 0) * (self._font.getNominalWidth() + self._charSpacing),
+                self._topMargin + max(row - 1, 0) * self.getLineHeight())
+
+    def _toCodes(text):
+        return np.frombuffer(bytes(text, 'latin-1', 'replace') if type(text) == str else bytes(text), dtype=np.uint8)
+
+    # width in pixels of each char of text
+    def getCharWidths(self, text):
+        return self._widthsTable[TextLayout._toCodes(text)]
+
+    # width of text printed in a single line
+    def getTextWidth(self, text):
+        widths = self.getCharWidths(text)
+        if len(widths) == 0:
+            return 0
+        return int(widths.sum()) + self._charSpacing * (len(widths) - 1)
+
+    # x of the left edge of each char of text printed in a single line from x0
+    def getCharPositions(self, text, x0 = 0):
+        advances = self.getCharWidths(text) + self._charSpacing
+        positions = np.empty(len(advances), dtype=np.int64)
+        positions[:1] = x0
+        np.cumsum(advances[:-1], out=positions[1:])
+        positions[1:] += x0
+        return positions
+
+    # split text in the lines printed by the panel when starting at x0 (the left margin by default). '\n' also
+    # starts a new line
+    def wrapLines(self, text, x0 = None):
+        if type(text) != str:
+            text = bytes(text).decode('latin-1')
+        x = self._leftMargin if x0 is None else x0
+        lines = []
+        for paragraph in text.split('\n'):
+            while True:
+                widths = self.getCharWidths(paragraph)
+                # right edge of each char if placed in this line
+                ends = x + np.cumsum(widths + self._charSpacing) - self._charSpacing
+                fittingCount = int(np.searchsorted(ends, self._panelWidth, side='right'))
+                if fittingCount >= len(paragraph):
+                    lines.append(paragraph)
+                    break
+                # at least one char per line, as the panel does
+                fittingCount = max(fittingCount, 1)
+                lines.append(paragraph[:fittingCount])
+                paragraph = paragraph[fittingCount:]
+                x = self._leftMargin
+            x = self._leftMargin
+        return lines
+
+    # (x0, y0, x1, y1) of the pixels covered by text printed from the pixel x,y, with x1 and y1 exclusive
+    def getBoundingBox(self, text, x = None, y = None):
+        x = self._leftMargin if x is None else x
+        y = self._topMargin if y is None else y
+        lines = self.wrapLines(text, x)
+        # the first line starts at x, and the next ones at the left margin
+        lineStarts = [x] + [self._leftMargin] * (len(lines) - 1)
+        x0 = min((start for start, line in zip(lineStarts, lines) if line), default=x)
+        x1 = max((start + self.getTextWidth(line) for start, line in zip(lineStarts, lines) if line), default=x)
+        height = len(lines) * self._font.getHeight() + (len(lines) - 1) * self._lineSpacing
+        return (x0, y, x1, y + height)
+
+    # same as getBoundingBox, for text printed at a cursor position
+    def getCellBoundingBox(self, text, col, row):
+        return self.getBoundingBox(text, *self.cellToPixel(col, row))
@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 import time
-from math import pi, sin, cos 
+from math import pi
 from threading import Thread 
 from random import random,randint
 from sys import argv, path
+import numpy as np
 
 path.append("..")
 from PyMOPanel import PyMOPanel
 from PyMOPanel.graphics import Graphics
 from PyMOPanel.bar_graph import Direction, BarGraphManager
 from PyMOPanel.gpo import LedStatus
+from PyMOPanel.strip_chart import StripChart
+from PyMOPanel.frame_scheduler import SchedulingPolicy
+from PyMOPanel.compositor import AnimationCompositor
 
 class Demo:
     def demoThreadedLedChanges(self):
@@ -30,17 +34,15 @@ class Demo:
 
     def drawSpiral(self, color, centerPos, maxRadius, incRadius = 0.03, incAngle = pi/100, startingAngle =0):
         self._panel.graphics.setDrawingColor(color)
-        angle = startingAngle
-        radius = 0
-        while radius < maxRadius:
-            x = int(centerPos[0] + cos(angle) * radius)
-            y = int(centerPos[1] + sin(angle) * radius)
-            if x<0 or x>Graphics.PANEL_WIDTH or y <0 or y > Graphics.PANEL_HEIGHT:
-                break
-            self._panel.graphics.drawPixel(x,y)
-            radius += incRadius
-            angle +=incAngle
-            time.sleep(0.00003)
+        steps = np.arange(int(np.ceil(maxRadius / incRadius)))
+        radius = steps * incRadius
+        angle = startingAngle + steps * incAngle
+        xs = (centerPos[0] + np.cos(angle) * radius).astype(int)
+        ys = (centerPos[1] + np.sin(angle) * radius).astype(int)
+        # stop at the first point out of the screen
+        outOfScreen = np.flatnonzero((xs < 0) | (xs > Graphics.PANEL_WIDTH) | (ys < 0) | (ys > Graphics.PANEL_HEIGHT))
+        pointsCount = outOfScreen[0] if outOfScreen.size else len(steps)
+        self._panel.graphics.drawPixels(xs[:pointsCount], ys[:pointsCount])
 
     def startLedsDemoThread(self):
         self._ledsDemoRunning = True
@@ -92,22 +94,37 @@ class Demo:
         for i in range(cycles):
             self._panel.screen.clear()
             #time.sleep(0.1)
-            phaseX=0
-            phaseY=0
             incPhaseX = random()*pi/60
             incPhaseY = random()*pi/60
-            for frame in range(1500):
-                x = Graphics.CENTER_X + int(Graphics.CENTER_X * cos(phaseX))
-                y = Graphics.CENTER_Y + int(Graphics.CENTER_Y * sin(phaseY))
-                self._panel.graphics.drawPixel(x,y)
-                phaseX += incPhaseX
-                phaseY += incPhaseY
-                time.sleep(0.00003)
+            frames = np.arange(1500)
+            xs = Graphics.CENTER_X + (Graphics.CENTER_X * np.cos(frames * incPhaseX)).astype(int)
+            ys = Graphics.CENTER_Y + (Graphics.CENTER_Y * np.sin(frames * incPhaseY)).astype(int)
+            self._panel.graphics.drawPixels(xs, ys)
+
+    # scrolling chart on the top half and sweeping chart on the bottom half, fed with 10 samples per pixel column
+    def runDemoStripCharts(self, columnsCount, samplesPerColumn = 10):
+        self._panel.screen.clear()
+        halfHeight = Graphics.CENTER_Y
+        charts = [StripChart(self._panel, 0, 0,          Graphics.PANEL_WIDTH, halfHeight - 1, -1.2, 1.2, samplesPerColumn, scroll=True),
+                  StripChart(self._panel, 0, halfHeight, Graphics.PANEL_WIDTH, halfHeight,     -1.2, 1.2, samplesPerColumn, scroll=False)]
+        times = np.arange(columnsCount * samplesPerColumn) / samplesPerColumn
+        samples = np.sin(times * 2 * pi / 60) + np.random.normal(0, 0.1, len(times))
+        for column in range(columnsCount):
+            for chart in charts:
+                chart.addSamples(samples[column * samplesPerColumn:(column + 1) * samplesPerColumn])
+                chart.refresh()
+        print("strip charts bytes per column: scroll {:.1f}, sweep {:.1f}".format(*[chart.getBytesSent() / columnsCount for chart in charts]))
+
+    # three animations side by side, each one at its own frame rate, played from a single timing loop
+    def runDemoCompositor(self, duration):
+        compositor = AnimationCompositor(self._panel)
+        compositor.addAnimation('resources/gif/resized_52hLxti.gif', x0=0,   framesPerSecond = 20, loop=True)
+        compositor.addAnimation('resources/gif/resized_gjp3TEn.gif', x0=64,  framesPerSecond = 30, loop=True)
+        compositor.addAnimation('resources/gif/resized_xxs5we8.gif', x0=128, framesPerSecond = 25, loop=True)
+        print("compositor: {}".format(compositor.play(duration)))
 
 def main(port):
-    myPanel = PyMOPanel(port=port)
-    myPanel.setBaudRate(19200)
-    myPanel.setBaudRate(115200)
+    myPanel = PyMOPanel(port=port, baudrate=115200, autoDetectBaudRate=True)
     demo = Demo(myPanel)
 
     # in my panel neither of these work
@@ -145,6 +162,11 @@ def main(port):
 
     time.sleep(1)
 
+    # strip charts
+    demo.runDemoStripCharts(300)
+
+    time.sleep(1)
+
     # draw spirals
     demo.runDemoSpirals(40)
     
@@ -158,9 +180,14 @@ def main(port):
     demo.stopLedsDemoThread()
     myPanel.screen.clear()
     time.sleep(1)
-    myPanel.graphics.uploadAndShowBitmap('resources/gif/resized_corridor.gif', x0=40, framesPerSecond = 10)
+    print("full frames:  {}".format(myPanel.graphics.uploadAndShowBitmap('resources/gif/resized_corridor.gif', x0=40, framesPerSecond = 10)))
+    print("delta frames: {}".format(myPanel.graphics.uploadAndShowBitmap('resources/gif/resized_corridor.gif', x0=40, framesPerSecond = 10, deltaEncoding=True)))
+    print("30 fps, dropping frames: {}".format(myPanel.graphics.uploadAndShowBitmap('resources/gif/resized_corridor.gif', x0=40, framesPerSecond = 30, schedulingPolicy=SchedulingPolicy.DROP)))
+    print("30 fps, merging frames:  {}".format(myPanel.graphics.uploadAndShowBitmap('resources/gif/resized_corridor.gif', x0=40, framesPerSecond = 30, schedulingPolicy=SchedulingPolicy.MERGE)))
     myPanel.graphics.uploadAndShowBitmap('resources/gif/resized_corridor.gif', x0=40, inverted=True, framesPerSecond = 6)
     time.sleep(0.2)
+    demo.runDemoCompositor(5)
+    myPanel.screen.clear()
     myPanel.graphics.uploadAndShowBitmap('resources/gif/resized_line.gif', x0=50, thresholdForBW=128)
     myPanel.graphics.uploadAndShowBitmap('resources/gif/resized_line.gif', x0=50)
     time.sleep(0.5)
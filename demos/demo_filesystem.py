@@ -9,16 +9,20 @@ from PyMOPanel.font import *
 
 def main(port):
     myPanel = Panel(port=port)
-
-    print("Customer data: {}".format(str(myPanel.fs.readCustomerData())))
+    # read the port from a single thread, so several queries can be pipelined
+    myPanel.startReceiver()
+    with myPanel.batch():
+        customerData = myPanel.fs.readCustomerDataAsync()
+        freeSpace    = myPanel.fs.freeAsync()
+
+    print("Customer data: {}".format(str(customerData.result())))
+    print("filesystem free space: {} bytes".format(freeSpace.result()))
     # uncomment if you want to ovewrite the customer data
     #myPanel.fs.writeCustomerData("Up to 16 chars")
 
     # dump complete filesystem to a file
     myPanel.fs.downloadFS('filesystem.data')
 
-    print("filesystem free space: {} bytes".format(myPanel.fs.free()))
-
     filesystemContent = myPanel.fs.ls()
     print("filesystem content: {}".format(pprint.pformat(filesystemContent)))
 
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 import psutil
 import time
 from sys import path, argv
@@ -7,66 +8,65 @@ from sys import path, argv
 path.append("..")
 from PyMOPanel import PyMOPanel
 from PyMOPanel.bar_graph import Direction, BarGraphManager
-from PyMOPanel.filesystem import FileType
 from PyMOPanel.graphics import Graphics
-from PyMOPanel.font import Font
+from PyMOPanel.text_field import TextGrid, TextField
 
 def main(port):
-    panel = PyMOPanel(port=port)
-
-    # To prevent baudrate mismatches between the host and the panel, since using in the code both 19200 (default) and 115200 and 
-    # a program may be stopped when using 115200, here we first set the baud rate to 115200. So if the panel is at 19200 it will 
-    # effectively change both the host and the panel to 115200. But if the panel was at 115200, the command (sent at 19200) won't
-    # be a valid command and will be ignored by the panel -or print just garbage-, but the serial connection would be set at 115200,
-    # matching the panel. Then we just set our desired baudrate to work: 19200
-
-    panel.setBaudRate(115200)
-    panel.setBaudRate(19200)
+    # the panel may have been left at any baud rate (e.g. if a program was stopped in a high speed session), so
+    # its current rate is detected and then set to 19200
+    panel = PyMOPanel(port=port, baudrate=19200, autoDetectBaudRate=True)
 
     panel.screen.clear()
     panel.screen.enable(True)
 
     # check available fonts, and select first one available. TODO: upload custom font?
-    available_font_ids = ([file['file_index'] for file in panel.fs.ls() if file['file_type'] == FileType.FONT])
-    for font_id_to_use in available_font_ids:
-        font_to_use = Font.fromBuffer(panel.fs.downloadFile(FileType.FONT, font_id_to_use))
-        if font_to_use:
-            break
+    # fonts are downloaded once (in a single high speed session), and then loaded from the cache directory
+    panel.fonts.setCacheDirectory(os.path.join(os.path.expanduser('~'), '.cache', 'PyMOPanel', 'fonts'))
+    with panel.highSpeed():
+        available_font_ids = panel.fs.getFontIds()
+        for font_id_to_use in available_font_ids:
+            font_to_use = panel.fonts.getFont(font_id_to_use)
+            if font_to_use:
+                break
     assert font_to_use
     print ("Using font id {}".format(font_id_to_use))
     panel.text.selectCurrentFont(font_id_to_use)
 
     panel.keyboard.controlBrighnessAndContrastByKeypad(True)
-    number_of_lines = int(Graphics.PANEL_HEIGHT / font_to_use.getHeight())
+    layout = panel.text.getLayout(font_to_use)
+    number_of_lines = layout.getRowsCount()
 
     # show layout for up to lines-1 cpus
     cpu_count = psutil.cpu_count()
     cpu_to_show_count = min(number_of_lines-1, cpu_count)
 
     left_margin = panel.text.getLeftMargin()
-    top_margin = panel.text.getTopMargin()
-    char_spacing = panel.text.getCharSpacing()
-    line_spacing = panel.text.getLineSpacing()
 
     template_for_cpu_caption = "cpu{}:     %"
-    text_length_in_chars = len(template_for_cpu_caption.format(1))
-    text_width_in_pixels = font_to_use.getNominalWidth() * text_length_in_chars + char_spacing * (text_length_in_chars-1)
+    # widest caption, measured with the actual width of each char
+    text_width_in_pixels = max(layout.getTextWidth(template_for_cpu_caption.format(cpu_number)) for cpu_number in range(cpu_to_show_count))
 
-    bar_height = int(Graphics.PANEL_HEIGHT / number_of_lines)
+    # each bar covers the pixel rows of its text line
+    bar_height = font_to_use.getHeight()
     bar_width = Graphics.CENTER_X - text_width_in_pixels
     assert bar_width > 0
 
+    # the text is kept in a grid, so each refresh only sends the chars that changed
+    text_grid = TextGrid(panel, cols=len(template_for_cpu_caption.format(0)), rows=cpu_to_show_count+1, layout=layout, fontRefId=font_id_to_use)
+    text_grid.markCleared()
+    value_fields = [TextField(text_grid, col=6, row=row, width=5, alignRight=True) for row in range(1, cpu_to_show_count+2)]
+
     offset_x = left_margin + text_width_in_pixels + 4
-    offset_y = top_margin
     for cpu_number in range(cpu_to_show_count):
-        panel.text.print(template_for_cpu_caption.format(cpu_number), col=0, row=cpu_number+1)
+        text_grid.setText(template_for_cpu_caption.format(cpu_number), col=1, row=cpu_number+1)
+        _, offset_y = layout.cellToPixel(1, cpu_number+1)
         panel.barGraphs.addBarGraph(offset_x,  offset_y,
                                       bar_width, bar_height,
                                       Direction(Direction.HORIZONTAL_LEFT_TO_RIGHT))
-        offset_y += line_spacing + bar_height
 
     # last line show mem usage
-    panel.text.print("mem.:     %", col=0, row=cpu_to_show_count+1)
+    text_grid.setText("mem.:     %", col=1, row=cpu_to_show_count+1)
+    _, offset_y = layout.cellToPixel(1, cpu_to_show_count+1)
     panel.barGraphs.addBarGraph(offset_x,  offset_y,
                                   bar_width, bar_height,
                                   Direction(Direction.HORIZONTAL_LEFT_TO_RIGHT))
@@ -74,12 +74,15 @@ def main(port):
     while True:
         cpu_percentage_per_cpu = psutil.cpu_percent(0.3, percpu=True)
         memory_percentage_usage = psutil.virtual_memory().percent
-        for cpu_number in range(cpu_to_show_count):
-            panel.barGraphs.setBarGraphValue(cpu_number, cpu_percentage_per_cpu[cpu_number] / 100)
-            panel.text.print("{:5.1f}".format(cpu_percentage_per_cpu[cpu_number]), col= 5, row=cpu_number+1)
+        # send the whole refresh in a single write
+        with panel.batch():
+            for cpu_number in range(cpu_to_show_count):
+                panel.barGraphs.setBarGraphValue(cpu_number, cpu_percentage_per_cpu[cpu_number] / 100)
+                value_fields[cpu_number].setText("{:5.1f}".format(cpu_percentage_per_cpu[cpu_number]))
         
-        panel.barGraphs.setBarGraphValue(cpu_to_show_count,  memory_percentage_usage/ 100)
-        panel.text.print("{:5.1f}".format(memory_percentage_usage), col=5, row=cpu_to_show_count+1)
+            panel.barGraphs.setBarGraphValue(cpu_to_show_count,  memory_percentage_usage/ 100)
+            value_fields[cpu_to_show_count].setText("{:5.1f}".format(memory_percentage_usage))
+            text_grid.refresh()
             
         time.sleep(0.3)
 
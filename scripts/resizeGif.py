@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# resize an animated gif (or any image) to fit in the panel screen, keeping its aspect ratio, and save it as
+# resized_<name> in the same directory. The frames are coalesced, as in the player.
+# Usage: resizeGif.py <image> [<width> <height>]
+from os import path as os_path
+from sys import argv, exit, path
+path.append(os_path.join(os_path.dirname(os_path.abspath(__file__)), ".."))
+from PIL import Image
+from PyMOPanel.bitmap import fitImage, SCREEN_WIDTH, SCREEN_HEIGHT
+
+def resize_gif(input_filename, width = SCREEN_WIDTH, height = SCREEN_HEIGHT):
+    directory, basename = os_path.split(input_filename)
+    output_filename = os_path.join(directory, 'resized_' + basename)
+    img = Image.open(input_filename)
+    frames = []
+    durations = []
+    for frame in range(getattr(img, 'n_frames', 1)):
+        img.seek(frame)
+        frames.append(fitImage(img.convert('RGBA'), width, height, enlarge=True))
+        durations.append(img.info.get('duration', 100))
+    frames[0].save(output_filename, save_all=True, append_images=frames[1:], duration=durations, loop=img.info.get('loop', 0), disposal=1)
+    return output_filename
+
+if __name__ == '__main__':
+    if len(argv) not in (2, 4):
+        print("Usage: {} <image> [<width> <height>]".format(argv[0]))
+        exit(1)
+    size = (int(argv[2]), int(argv[3])) if len(argv) == 4 else ()
+    print(resize_gif(argv[1], *size))
@@ -0,0 +1,25 @@
+import ast
+import importlib.util
+import os
+import pytest
+
+DEMOS_DIRECTORY = os.path.join(os.path.dirname(__file__), '..', 'demos')
+DEMOS = sorted(filename for filename in os.listdir(DEMOS_DIRECTORY) if filename.endswith('.py'))
+
+# names the demo imports from PyMOPanel (the demos need a panel and other packages to run, so only their imports
+# from the library are checked)
+def getPyMOPanelImports(filename):
+    with open(os.path.join(DEMOS_DIRECTORY, filename)) as demoFile:
+        tree = ast.parse(demoFile.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module and node.module.split('.')[0] == 'PyMOPanel':
+            for alias in node.names:
+                yield node.module, alias.name
+
+@pytest.mark.parametrize('filename', DEMOS)
+def test_demo_imports_exist(filename):
+    for moduleName, name in getPyMOPanelImports(filename):
+        module = importlib.import_module(moduleName)
+        if name != '*':
+            isSubmodule = hasattr(module, '__path__') and importlib.util.find_spec(moduleName + '.' + name) is not None
+            assert hasattr(module, name) or isSubmodule, (moduleName, name)
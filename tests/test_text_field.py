@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+import numpy as np
+from PyMOPanel.font import Font
+from PyMOPanel.graphics import Graphics
+from PyMOPanel.shadow_state import ShadowState
+from PyMOPanel.text import Text
+from PyMOPanel.text_layout import TextLayout
+from PyMOPanel.text_field import TextGrid, TextField
+
+FONT_HEIGHT = 8
+CHAR_WIDTHS = {'W': 7, 'i': 1, ' ': 3}
+
+# font with solid glyphs (blank for the space) of different widths
+def makeFont():
+    chars = {}
+    for code in range(32, 127):
+        char = chr(code)
+        chars[char] = np.full((FONT_HEIGHT, CHAR_WIDTHS.get(char, 5)), 0 if char == ' ' else 1, dtype=np.uint8)
+    return Font.fromDictOfUnpackedNumpyArray({'nominal_width': 5, 'height': FONT_HEIGHT, 'ascii_start_value': 32, 'ascii_end_value': 126, 'chars': chars})
+
+# panel recording the bytes written
+class RecordingPanel:
+    def __init__(self):
+        self.written = bytearray()
+        self.shadowState = ShadowState()
+        self.graphics = Graphics(self)
+        self.text = Text(self)
+
+    def writeBytes(self, buffer, lane = None):
+        self.written += bytes(buffer)
+
+    @contextmanager
+    def batch(self):
+        yield self
+
+# raster of the screen after the cursor moves, solid rectangles and text of buffer. Chars are drawn with their glyph,
+# leaving the spacing between them untouched
+def render(buffer, font, screen):
+    asciiStart = font.getAsciiRange()[0]
+    x = y = 0
+    i = 0
+    while i < len(buffer):
+        if buffer[i] != 0xfe:
+            glyph = font.getGlyphBits(buffer[i] - asciiStart)
+            height, width = glyph.shape
+            screen[y:y + height, x:x + width] = glyph[:screen.shape[0] - y, :screen.shape[1] - x]
+            x += width + 1
+            i += 1
+        elif buffer[i + 1] == 0x79:
+            x, y = buffer[i + 2], buffer[i + 3]
+            i += 4
+        elif buffer[i + 1] == 0x78:
+            color, x0, y0, x1, y1 = buffer[i + 2:i + 7]
+            screen[y0:y1 + 1, x0:x1 + 1] = 1 if color else 0
+            i += 7
+        else:
+            raise Exception("unexpected command 0x{:02x}".format(buffer[i + 1]))
+    return screen
+
+def renderTexts(font, texts):
+    panel = RecordingPanel()
+    grid = TextGrid(panel, layout=TextLayout(font))
+    grid.markCleared()
+    panel.written.clear()
+    for text in texts:
+        grid.setText(text, 1, 1)
+        grid.refresh()
+    return render(panel.written, font, np.zeros((Graphics.PANEL_HEIGHT, Graphics.PANEL_WIDTH), dtype=np.uint8)), grid
+
+def test_proportional_rewrite_matches_fresh_render():
+    font = makeFont()
+    for texts in (["WWWW 1", "i     "], ["WWWW 1", "WW", "i"], ["i1i1", "WWWW", "1"], ["WWWW", "WWWi", "WWWW"]):
+        screen, grid = renderTexts(font, texts)
+        freshScreen, _ = renderTexts(font, [grid.getText(1)])
+        assert np.array_equal(screen, freshScreen), texts
+
+def test_text_field_pads_and_sends_only_changed_chars():
+    panel = RecordingPanel()
+    grid = TextGrid(panel, cols=11, rows=1)
+    grid.markCleared()
+    grid.setText("cpu0:     %", 1, 1)
+    field = TextField(grid, col=6, row=1, width=5, alignRight=True)
+    field.setText("12.5")
+    grid.refresh()
+    assert field.getText() == " 12.5"
+    assert grid.getText(1) == "cpu0: 12.5%"
+    field.setText("13.5")
+    assert grid.refresh() == TextGrid.CURSOR_MOVE_SIZE + 1